@@ -0,0 +1,259 @@
+"""HTTP API for the chat engine.
+
+    python api.py --port 8080 --workers 8 --max-queue 32
+
+- ``POST /v1/ask`` with ``{"question": ..., "session_id": ..., "preinject_schema": true}``
+  returns the answer as JSON
+- ``POST /v1/ask/stream`` takes the same body and returns newline-delimited
+  JSON: ``{"type": "text", "delta": ...}`` events while the answer is
+  generated, then one ``{"type": "answer", ...}`` event; ``{"type": "reset"}``
+  drops the text sent so far (the model turned to a function call, or a
+  failed stream is retried)
+- ``GET /healthz`` reports readiness and the current load
+- ``GET /metrics`` exposes the engine and admission counters in the
+  Prometheus text format; ``GET /v1/stats`` returns them as JSON
+
+At most ``--workers`` questions run at once. Up to ``--max-queue`` more
+wait for a slot, for at most ``--queue-timeout`` seconds; beyond that the
+request is refused with 503 and ``Retry-After`` so a load balancer can try
+another instance. The server listens as soon as it starts and builds the
+engine in the background; ``/healthz`` answers 503 until it is ready, for
+use as the startup probe. Workers keep no session state (see ``engine.py``), so
+instances scale independently of the Streamlit UI. The server runs on
+tornado, which Streamlit already depends on.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import sys
+import uuid
+
+import tornado.iostream
+import tornado.web
+
+from engine import get_engine
+
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_QUEUE = 32
+DEFAULT_QUEUE_TIMEOUT_SECONDS = 30
+RETRY_AFTER_SECONDS = 2
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Admission:
+    """Worker-slot limit with a bounded wait queue."""
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE,
+                 queue_timeout=DEFAULT_QUEUE_TIMEOUT_SECONDS):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(workers)
+        self.inflight = 0
+        self.queued = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        if not self._slots.locked():
+            # a free slot is taken without suspending, so a burst cannot overbook it
+            await self._slots.acquire()
+        elif self.queued >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(f"{self.queued} requests already waiting")
+        else:
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise Overloaded(f"no worker free after {self.queue_timeout} seconds")
+            finally:
+                self.queued -= 1
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            self.completed += 1
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "inflight": self.inflight,
+            "queued": self.queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+def prometheus_lines(stats, prefix="chat"):
+    """Flatten nested stats into ``name value`` lines; non-numeric values become labels."""
+    lines = []
+    for key, value in sorted(stats.items()):
+        name = f"{prefix}_{key}".replace("-", "_")
+        if isinstance(value, dict):
+            lines.extend(prometheus_lines(value, name))
+        elif isinstance(value, bool):
+            lines.append(f"{name} {int(value)}")
+        elif isinstance(value, (int, float)):
+            lines.append(f"{name} {value}")
+        else:
+            lines.append(f'{name}{{value="{value}"}} 1')
+    return lines
+
+
+class _Handler(tornado.web.RequestHandler):
+    @property
+    def startup(self):
+        # resolves to the engine once it is built
+        return self.application.settings["engine"]
+
+    async def engine(self):
+        return await self.startup
+
+    def ready_engine(self):
+        if not self.startup.done():
+            raise tornado.web.HTTPError(503, reason="starting")
+        return self.startup.result()
+
+    @property
+    def admission(self):
+        return self.application.settings["admission"]
+
+    def _request(self):
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="body is not JSON")
+        question = body.get("question")
+        if not isinstance(question, str) or not question.strip():
+            raise tornado.web.HTTPError(400, reason="question is required")
+        return body.get("session_id") or uuid.uuid4().hex, question, bool(body.get("preinject_schema", True))
+
+    def _overloaded(self, error):
+        self.set_status(503)
+        self.set_header("Retry-After", str(RETRY_AFTER_SECONDS))
+        self.finish({"error": "overloaded", "detail": str(error)})
+
+
+class AskHandler(_Handler):
+    async def post(self):
+        session_id, question, preinject_schema = self._request()
+        try:
+            async with self.admission.slot():
+                engine = await self.engine()
+                answer = await engine.ask(session_id, question, preinject_schema=preinject_schema)
+        except Overloaded as e:
+            return self._overloaded(e)
+        self.finish(answer)
+
+
+class AskStreamHandler(_Handler):
+    async def post(self):
+        session_id, question, preinject_schema = self._request()
+        try:
+            async with self.admission.slot():
+                await self._stream(session_id, question, preinject_schema)
+        except Overloaded as e:
+            return self._overloaded(e)
+        except tornado.iostream.StreamClosedError:
+            pass
+
+    async def _stream(self, session_id, question, preinject_schema):
+        self.set_header("Content-Type", "application/x-ndjson")
+        texts = asyncio.Queue()
+        engine = await self.engine()
+        turn = asyncio.ensure_future(
+            engine.ask(session_id, question, on_text=texts.put_nowait, preinject_schema=preinject_schema)
+        )
+        sent = ""
+        try:
+            while not turn.done() or not texts.empty():
+                getter = asyncio.ensure_future(texts.get())
+                await asyncio.wait([getter, turn], return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    continue
+                # on_text gets the whole answer so far, send only what is new
+                text = getter.result()
+                if not text.startswith(sent):
+                    await self._event({"type": "reset"})
+                    sent = ""
+                if len(text) > len(sent):
+                    await self._event({"type": "text", "delta": text[len(sent):]})
+                    sent = text
+            await self._event({"type": "answer", **turn.result()})
+        finally:
+            turn.cancel()
+        self.finish()
+
+    async def _event(self, event):
+        self.write(json.dumps(event) + "\n")
+        await self.flush()
+
+
+class HealthHandler(_Handler):
+    def get(self):
+        if not self.startup.done():
+            self.set_status(503)
+            return self.finish({"status": "starting", **self.admission.stats()})
+        self.finish({"status": "ok", **self.admission.stats()})
+
+
+class StatsHandler(_Handler):
+    def get(self):
+        self.finish({"engine": self.ready_engine().stats(), "admission": self.admission.stats()})
+
+
+class MetricsHandler(_Handler):
+    def get(self):
+        lines = prometheus_lines({"engine": self.ready_engine().stats(), "admission": self.admission.stats()})
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.finish("\n".join(lines) + "\n")
+
+
+def make_app(startup, admission):
+    """``startup`` is an asyncio future (or task) that resolves to the engine."""
+    return tornado.web.Application(
+        [
+            (r"/v1/ask", AskHandler),
+            (r"/v1/ask/stream", AskStreamHandler),
+            (r"/v1/stats", StatsHandler),
+            (r"/healthz", HealthHandler),
+            (r"/metrics", MetricsHandler),
+        ],
+        engine=startup,
+        admission=admission,
+    )
+
+
+async def serve(port, workers, max_queue, queue_timeout):
+    admission = Admission(workers, max_queue, queue_timeout)
+    startup = asyncio.ensure_future(asyncio.to_thread(get_engine))
+    make_app(startup, admission).listen(port)
+    print(f"chat API listening on :{port} with {workers} workers")
+    await startup
+    await asyncio.Event().wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="questions answered at once")
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE, help="questions waiting for a worker")
+    parser.add_argument("--queue-timeout", type=float, default=DEFAULT_QUEUE_TIMEOUT_SECONDS)
+    args = parser.parse_args(argv)
+    asyncio.run(serve(args.port, args.workers, args.max_queue, args.queue_timeout))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,104 +1,41 @@
-import time
-from google.cloud import bigquery
+import os
+import uuid
+
 import streamlit as st
-import vertexai
-from vertexai.generative_models import FunctionDeclaration, GenerativeModel, Part, Tool
 
-vertexai.init(
-    project="asc-colabathon",
-    location="us-central1"
-)
+from client import HttpEngineClient, LocalEngineClient
+from history import DEFAULT_VISIBLE_MESSAGES, SessionHistory, SpillStore
+from orchestrator import CANNOT_FULFILL
+from tracing import span
 
-BIGQUERY_DATASET_ID = "UDMH"
-GCP_PROJECT_ID= "asc-colabathon"
+# CHAT_API_URL=http://chat-api:8080 uses the API service (api.py) instead of
+# running the engine inside this Streamlit process
+CHAT_API_URL = os.environ.get("CHAT_API_URL")
 
-list_datasets_func = FunctionDeclaration(
-    name="list_datasets",
-    description="Get a list of datasets",
-    parameters={
-        "type": "object",
-        "properties": {},
-    },
+st.set_page_config(
+    page_title="AI Chat bot for the Clinical Data",
+    layout="wide",
 )
 
-list_tables_func = FunctionDeclaration(
-    name="list_tables",
-    description="List tables in all the datasets from the array of datasets given in arguments",
-    parameters={
-        "type": "object",
-        "properties": {
-            "dataset_id": {
-                "type": "array",
-                "description": "Dataset ID to fetch tables from.",
-            }
-        },
-        "required": [
-            "dataset_id",
-        ],
-    },
-)
 
-get_table_func = FunctionDeclaration(
-    name="get_table",
-    description="""Get information about a table, including the description, schema, and number of rows that will help answer the user's question.
-        Always use the fully qualified dataset and table names.""",
-    parameters={
-        "type": "object",
-        "properties": {
-            "table_id": {
-                "type": "string",
-                "description": "Fully qualified ID of the table to get information about",
-            }
-        },
-        "required": [
-            "table_id",
-        ],
-    },
-)
+@st.cache_resource
+def load_client():
+    if CHAT_API_URL:
+        return HttpEngineClient(CHAT_API_URL)
+    from engine import engine_ready, get_engine, start_engine
 
-sql_query_func = FunctionDeclaration(
-    name="sql_query",
-    description="""Get information from data in BigQuery using SQL queries. 
-        for all the queries use use UDMH as a default dataset.
-        use patient_dim for the patient data. use gender for sex. dob is date of birth. use the address column to determine the location, it is formatted as street address, city, state, zip code. use first_name and last_name for the name. use patient_id key to join with clncl_ordr_dim and enoucnter_dim table.
-        use provider_dim for the provider data. use first_name and last_name columns if name is needed. use provider_id key to join with clncl_ordr_dim and enoucnter_dim table.
-        use clncl_ordr_dim for all the clinical releted queries. this is provider ordering clinicals for the patients. use order_type to filter out the type of clinical orders (example: Medication, Lab, Imaging, Surgery). use order_date for all the date and time releated queries. use provider_id to join with provider_dim table. use patient_id to join with patient_dim table.
-        use encounter_dim for the patient encounters/visits/stays at the hospital with the provider. use the discharge_date-admission_date for the number of days stayed in the hospital. use provider_id to join with provider_dim table. use patient_id to join with patient_dim table. use reason column for the patient encounter reason. use department_name for 'Emergency', 'Outpatient', 'Inpatient', 'ICU', 'Pharmacy', 'Radiology', 'Laboratory'
-        use medication_dim for the medication details.
-        """,
-    parameters={
-        "type": "object",
-        "properties": {
-            "query": {
-                "type": "string",
-                "description": "SQL query on a single line that will help give quantitative answers to the user's question when run on a BigQuery dataset and table. In the SQL query, always use the fully qualified dataset and table names.",
-            }
-        },
-        "required": [
-            "query",
-        ],
-    },
-)
+    # the SDK imports and clients are built in the background while the page paints
+    start_engine()
+    return LocalEngineClient(get_engine, ready=engine_ready)
 
-sql_query_tool = Tool(
-    function_declarations=[
-        list_datasets_func,
-        list_tables_func,
-        get_table_func,
-        sql_query_func,
-    ],
-)
 
-model = GenerativeModel(
-    "gemini-2.0-flash", # "gemini-1.5-pro-001",
-    generation_config={"temperature": 0},
-    tools=[sql_query_tool],
-)
+client = load_client()
 
-st.set_page_config(
-    page_title="AI Chat bot for the Clinical Data",
-    layout="wide",
-)
+
+@st.cache_resource
+def load_spill_store():
+    # HISTORY_SPILL_DIR keeps spilled tool payloads on disk instead of in memory
+    return SpillStore(os.environ.get("HISTORY_SPILL_DIR"))
 
 col1, col2 = st.columns([8, 1])
 with col1:
@@ -121,182 +58,120 @@ with st.expander("Sample prompts", expanded=True):
         """
     )
 
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+with st.sidebar:
+    preinject_schema = st.toggle("Pre-inject schema context", value=True)
+    try:
+        stats = client.stats()
+    except Exception as e:
+        print("engine stats unavailable: " + str(e))
+        stats = {}
+    st.caption(f"Query backend: {stats.get('backend', 'unknown')}")
+    if "metadata_cache" in stats:
+        cache_stats = stats["metadata_cache"]
+        st.caption(
+            f"Metadata cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']} entries"
+        )
+    if "bigquery_pool" in stats:
+        pool_stats = stats["bigquery_pool"]
+        st.caption(
+            f"BigQuery pool: {pool_stats['clients']} clients, {pool_stats['checkouts']} checkouts, "
+            f"{pool_stats['connection_reuse']:.0%} connection reuse"
+        )
+    if "cost_guard" in stats:
+        st.caption("Cost guard: " + ", ".join(f"{k} {v}" for k, v in sorted(stats["cost_guard"].items())))
+    if "single_flight" in stats:
+        st.caption(
+            "Coalesced duplicate calls: "
+            + ", ".join(f"{name} {flight['coalesced']}" for name, flight in sorted(stats["single_flight"].items()))
+        )
+    if "cache_warmer" in stats:
+        warmer_stats = stats["cache_warmer"]
+        last_run = warmer_stats["last_run"] or {}
+        st.caption(
+            f"Cache warmer: {warmer_stats['warmed']} answers warmed in {warmer_stats['runs']} runs"
+            + (f", last {last_run['at']} ({last_run['reason']})" if last_run else "")
+        )
+    if "templates" in stats:
+        st.caption("Templates: " + ", ".join(f"{k} {v}" for k, v in sorted(stats["templates"].items())))
+        st.caption("Result cache: " + ", ".join(f"{k} {v}" for k, v in sorted(stats["result_cache"].items())))
+        ttft = stats["ttft"]
+        st.caption(f"Time to first token: p50 {ttft['p50_seconds']:.1f}s, p95 {ttft['p95_seconds']:.1f}s")
+        tokens = stats["tokens"]
+        st.caption(
+            f"Tokens per turn: {tokens['avg_prompt']:.0f} prompt ({tokens['avg_cached']:.0f} cached), "
+            f"{tokens['avg_output']:.0f} output"
+        )
+    for mode, summary in stats.get("round_trips", {}).items():
+        st.caption(
+            f"{mode}: {summary['questions']} questions, "
+            f"{summary['avg_round_trips']:.1f} round trips, "
+            f"p50 {summary['p50_seconds']:.1f}s, p95 {summary['p95_seconds']:.1f}s"
+        )
+
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if "history" not in st.session_state:
+    st.session_state.history = SessionHistory(load_spill_store())
+history = st.session_state.history
+with st.sidebar:
+    history_stats = history.stats()
+    st.caption(
+        f"Session history: {history_stats['messages']} messages kept, "
+        f"{history_stats['dropped']} compacted, {history_stats['chars']} chars"
+    )
+
+if history.compacted:
+    with st.expander(f"{history.dropped} earlier messages"):
+        st.markdown("\n".join("- " + question.replace("$", "\\$") for question in history.compacted))
 
-for message in st.session_state.messages:
+visible, hidden = history.visible(None if st.session_state.get("show_all_messages") else DEFAULT_VISIBLE_MESSAGES)
+if hidden and st.button(f"Show {hidden} earlier messages"):
+    st.session_state.show_all_messages = True
+    st.rerun()
+
+for message in visible:
     if message["role"] == "user": avatar = ":material/chevron_right:"
     else: avatar = ":material/double_arrow:"
     with st.chat_message(message["role"], avatar=avatar):
         st.markdown(message["content"].replace("$", "\$"))  # noqa: W605
-        # try:
-        #     with st.expander("Function calls, parameters, and responses"):
-        #         st.markdown(message["backend_details"])
-        # except KeyError:
-        #     pass
+        # with st.expander("Function calls, parameters, and responses"):
+        #     st.markdown(history.backend_details(message))
 
 if prompt := st.chat_input("Ask me about information in the database..."):
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    history.append("user", prompt)
     with st.chat_message("user", avatar=":material/chevron_right:"):
         st.markdown(prompt)
 
     with st.chat_message("assistant", avatar=":material/double_arrow:"):
         message_placeholder = st.empty()
-        full_response = ""
-        chat = model.start_chat()
-        client = bigquery.Client(GCP_PROJECT_ID)
-        prompt += """
-            Please give a concise, high-level summary followed by detail in
-            plain language about where the information in your response is
-            coming from in the database. Only use information that you learn
-            from BigQuery, do not make up information.
-            """
-        # this is the first prompt
-        response = chat.send_message(prompt)
-
-        response = response.candidates[0].content.parts[0]
-        # print(response)
-
-        api_requests_and_responses = []
-        backend_details = ""
-
-        params = {}
-        api_response = ""
-        datasets = list()
-        # this is used to learn the responses using gemini
-        function_calling_in_process = True
-        while function_calling_in_process:
-            try:
-                #setting params
-                
-                for key, value in response.function_call.args.items():
-                    params[key] = value
-                
-                print("1 - chat_send: " + str(api_response) + "; call_name: " + response.function_call.name + "; params: ")
-                print(", ".join(f"{k}: {v}" for k, v in params.items()))
-                
-                if response.function_call.name == "list_datasets":
-                    api_response = client.list_datasets()
-                    # api_response = str([dataset.dataset_id for dataset in api_response])
-                    for dataset in api_response:
-                        datasets.append(str(dataset.dataset_id))
-                    print("datasets: " + str(datasets))
-                    api_response = datasets # " ,".join(datasets)
-                    api_requests_and_responses.append(
-                        [response.function_call.name, params, api_response]
-                    )
-                    # datasets = api_response
-                if response.function_call.name == "list_tables":
-                    api_response = ""
-                    for d in params["dataset_id"]:
-                        print("dataset id = " + d)
-                        print(d)
-                        tmp_response = client.list_tables(d)
-                        tmp_response = str([table.table_id for table in tmp_response])
-                        print("inside:" + tmp_response)
-                        api_response = api_response + tmp_response
-                        api_requests_and_responses.append(
-                        [response.function_call.name, params, api_response])
-                    print("outside:" + api_response)
-
-                if response.function_call.name == "get_table":
-                    api_response = client.get_table(params["table_id"])
-                    api_response = api_response.to_api_repr()
-                    api_requests_and_responses.append(
-                        [
-                            response.function_call.name,
-                            params,
-                            [
-                                str(api_response.get("description", "")),
-                                str(
-                                    [
-                                        column["name"]
-                                        for column in api_response["schema"]["fields"]
-                                    ]
-                                ),
-                            ],
-                        ]
-                    )
-                    api_response = str(api_response)
 
-                if response.function_call.name == "sql_query":
-                    job_config = bigquery.QueryJobConfig(
-                        maximum_bytes_billed=100000000
-                    )  # Data limit per query job
-                    try:
-                        cleaned_query = (
-                            params["query"]
-                            .replace("\\n", " ")
-                            .replace("\n", "")
-                            .replace("\\", "")
-                        )
-                        query_job = client.query(cleaned_query, job_config=job_config)
-                        api_response = query_job.result()
-                        api_response = str([dict(row) for row in api_response])
-                        api_response = api_response.replace("\\", "").replace("\n", "")
-                        api_requests_and_responses.append(
-                            [response.function_call.name, params, api_response]
-                        )
-                    except Exception as e:
-                        api_response = f"{str(e)}"
-                        api_requests_and_responses.append(
-                            [response.function_call.name, params, api_response]
-                        )
-
-                print("2  - chat_send: " + str(api_response) + "; call_name: " + response.function_call.name + "; params: ")
-                print(", ".join(f"{k}: {v}" for k, v in params.items()))
-
-                response = chat.send_message(
-                    Part.from_function_response(
-                        name=response.function_call.name, 
-                        response={
-                            "content": api_response,
-                        },
-                    ),
-                )
-                response = response.candidates[0].content.parts[0]
-
-                backend_details += "- Function call:\n"
-                backend_details += (
-                    "   - Function name: ```"
-                    + str(api_requests_and_responses[-1][0])
-                    + "```"
-                )
-                backend_details += "\n\n"
-                backend_details += (
-                    "   - Function parameters: ```"
-                    + str(api_requests_and_responses[-1][1])
-                    + "```"
-                )
-                backend_details += "\n\n"
-                backend_details += (
-                    "   - API response: ```"
-                    + str(api_requests_and_responses[-1][2])
-                    + "```"
-                )
-                backend_details += "\n\n"
-                # with message_placeholder.container():
-                    # st.markdown(backend_details)
-
-            except AttributeError:
-                function_calling_in_process = False
-            except:
-                function_calling_in_process = False
-                full_response = "Cannot fulfill this request at this moment. Try a differnt prompt"
-
-        time.sleep(3)
-
-        if len(full_response) == 0:
-            full_response =  response.text
-        with message_placeholder.container():
+        def render_partial(text):
+            message_placeholder.markdown(text.replace("$", "\\$") + "▌")
+
+        try:
+            reply = client.ask(
+                st.session_state.session_id, prompt,
+                on_text=render_partial, preinject_schema=preinject_schema,
+            )
+        except Exception as e:
+            print("chat engine: " + repr(e))
+            reply = {"answer": CANNOT_FULFILL, "backend_details": "", "timeline": ""}
+
+        full_response = reply["answer"]
+        backend_details = reply["backend_details"]
+        # the turn's trace is already finished (or remote), so rendering gets a trace of its own
+        with span("render", turn_trace_id=reply.get("trace_id", "")) as render_span, message_placeholder.container():
             st.markdown(full_response.replace("$", "\$"))
         #     with st.expander("Function calls, parameters, and responses:"):
         #         st.markdown(backend_details)
 
-        st.session_state.messages.append(
-            {
-                "role": "assistant",
-                "content": full_response,
-                "backend_details": backend_details,
-            }
-        )
\ No newline at end of file
+        history.append("assistant", full_response, backend_details)
+        timeline = reply["timeline"]
+        if timeline:
+            timeline += f"\n{'render':<28} {'':<42} {render_span.duration_ms:8.1f} ms"
+        st.session_state.last_timeline = timeline
+
+if st.session_state.get("last_timeline"):
+    with st.expander("Last request timeline"):
+        st.code(st.session_state.last_timeline, language=None)
@@ -0,0 +1,124 @@
+"""Offline load test of the chat pipeline.
+
+Replays the prompts in benchmarks/corpus.json through the orchestrator with
+N concurrent simulated users. Gemini is replaced by the recorded replies in
+the corpus (with a simulated latency per round trip) and queries run on the
+local DuckDB backend, so numbers only depend on this code.
+
+    python benchmark.py --users 20 --iterations 5
+    python benchmark.py --save-baseline benchmarks/baseline.json
+    python benchmark.py --baseline benchmarks/baseline.json --tolerance 0.2
+
+With --baseline the run exits with status 1 when throughput drops, or
+latency, round trips or answer bytes grow, by more than the tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from fakes import FakeChat
+from local_tools import LocalTools
+from orchestrator import LlmReply, Orchestrator
+from schema_context import percentile
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "corpus.json")
+# metrics where a larger value is a regression; throughput is the other way round
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "round_trips_per_question", "bytes_per_answer")
+
+
+def load_corpus(path=DEFAULT_CORPUS):
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    return [
+        (
+            entry["prompt"],
+            [LlmReply(calls=[tuple(c) for c in r.get("calls", [])], text=r.get("text", "")) for r in entry["replies"]],
+        )
+        for entry in entries
+    ]
+
+
+async def run_benchmark(corpus, tools, users=10, iterations=3, llm_latency=0.0, orchestrator=None):
+    orchestrator = orchestrator or Orchestrator(tools)
+    samples = []
+
+    async def user(offset):
+        for i in range(iterations):
+            for j in range(len(corpus)):
+                prompt, replies = corpus[(offset + i + j) % len(corpus)]
+                chat = FakeChat(replies, latency=llm_latency)
+                started = time.perf_counter()
+                result = await orchestrator.run(chat, prompt)
+                samples.append((
+                    time.perf_counter() - started,
+                    result.round_trips,
+                    len(result.answer.encode("utf-8")) + sum(len(str(c.response)) for c in result.calls),
+                    result.failed,
+                ))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(n) for n in range(users)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [s[0] * 1000 for s in samples]
+    return {
+        "questions": len(samples),
+        "failed": sum(1 for s in samples if s[3]),
+        "throughput_qps": len(samples) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "round_trips_per_question": sum(s[1] for s in samples) / len(samples),
+        "bytes_per_answer": sum(s[2] for s in samples) / len(samples),
+    }
+
+
+def regressions(report, baseline, tolerance):
+    found = []
+    for name in LOWER_IS_BETTER:
+        if name in baseline and report[name] > baseline[name] * (1 + tolerance):
+            found.append(f"{name}: {report[name]:.2f} > baseline {baseline[name]:.2f}")
+    if "throughput_qps" in baseline and report["throughput_qps"] < baseline["throughput_qps"] * (1 - tolerance):
+        found.append(
+            f"throughput_qps: {report['throughput_qps']:.2f} < baseline {baseline['throughput_qps']:.2f}"
+        )
+    if report["failed"] > baseline.get("failed", 0):
+        found.append(f"failed: {report['failed']} > baseline {baseline.get('failed', 0)}")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated seconds per Gemini round trip")
+    parser.add_argument("--baseline", help="fail when results regress against this JSON report")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--save-baseline", help="write the report to this path")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_benchmark(
+        load_corpus(args.corpus), LocalTools(),
+        users=args.users, iterations=args.iterations, llm_latency=args.llm_latency,
+    ))
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        for line in found:
+            print("REGRESSION " + line)
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""Row-by-row versus columnar (Arrow) result fetching and post-processing.
+
+Scales encounter_dim and clncl_ordr_dim from UDMH_dummyData.zip up by
+``--scale`` (dates spread over two years) in the local DuckDB backend, then
+for each table measures:
+
+- ``rows``: fetch pages of tuples, make a ``dict(row)`` per row (what the
+  BigQuery ``RowIterator`` path does), then top-K, group-by, weekly date
+  buckets and summary stats in Python
+- ``arrow``: fetch record batches into one ``pyarrow.Table`` and run the
+  same post-processing with ``pyarrow.compute``
+- ``query``: ``LocalTools.query`` end to end with each fetch path (both
+  stop reading after ``SCAN_ROWS`` rows)
+
+    python benchmark_fetch.py --scale 400 --repeat 3
+
+Needs pyarrow.
+"""
+import argparse
+import collections
+import datetime
+import heapq
+import json
+import sys
+import time
+
+import columnar
+from columnar import pc, pyarrow
+from local_tools import LocalTools, record_batches
+from serialization import PAGE_SIZE
+
+WORKLOADS = {
+    "encounter_dim": {
+        "sql": (
+            "SELECT encounter_id, patient_id, department_name, admission_date, "
+            "DATE_DIFF(discharge_date, admission_date, DAY) AS los_days FROM bench.encounter_dim"
+        ),
+        "top": "los_days",
+        "group": "department_name",
+        "value": "los_days",
+        "date": "admission_date",
+    },
+    "clncl_ordr_dim": {
+        "sql": "SELECT order_id, order_type, department_name, order_date FROM bench.clncl_ordr_dim",
+        "top": "order_date",
+        "group": "order_type",
+        "value": None,
+        "date": "order_date",
+    },
+}
+# columns whose ids must stay unique and dates that are spread out in the copies
+_SCALED = {
+    "encounter_dim": ("encounter_id", ("admission_date", "discharge_date")),
+    "clncl_ordr_dim": ("order_id", ("order_date",)),
+}
+
+
+def scale_tables(tools, scale):
+    tools.cursor("CREATE SCHEMA IF NOT EXISTS bench")
+    for table, (id_column, date_columns) in _SCALED.items():
+        replaced = [f"{id_column} || '-' || copy AS {id_column}"] + [
+            f"{column} + CAST(copy % 730 AS INTEGER) AS {column}" for column in date_columns
+        ]
+        tools.cursor(
+            f"CREATE OR REPLACE TABLE bench.{table} AS "
+            f"SELECT * REPLACE ({', '.join(replaced)}) "
+            f"FROM {tools.dataset_id}.{table}, range({int(scale)}) AS copies(copy)"
+        )
+    return {table: tools.cursor(f"SELECT COUNT(*) FROM bench.{table}").fetchone()[0] for table in _SCALED}
+
+
+def fetch_rows(tools, sql):
+    cursor = tools.cursor(sql)
+    names = [col[0] for col in cursor.description]
+    rows = []
+    while True:
+        page = cursor.fetchmany(PAGE_SIZE)
+        if not page:
+            return rows
+        rows.extend(dict(zip(names, values)) for values in page)
+
+
+def post_process_rows(rows, spec):
+    top = heapq.nlargest(10, (r for r in rows if r[spec["top"]] is not None), key=lambda r: r[spec["top"]])
+    groups = collections.defaultdict(list)
+    for row in rows:
+        groups[row[spec["group"]]].append(row[spec["value"]] if spec["value"] else 1)
+    grouped = {
+        key: (sum(values) / len(values) if spec["value"] else len(values)) for key, values in groups.items()
+    }
+    buckets = collections.Counter(
+        row[spec["date"]] - datetime.timedelta(days=row[spec["date"]].weekday())
+        for row in rows
+        if row[spec["date"]] is not None
+    )
+    stats = {}
+    for column in {spec["date"], spec["value"] or spec["date"]}:
+        values = [row[column] for row in rows if row[column] is not None]
+        stats[column] = {
+            "min": min(values, default=None),
+            "max": max(values, default=None),
+            "nulls": len(rows) - len(values),
+        }
+    return top, grouped, sorted(buckets.items()), stats
+
+
+def fetch_arrow(tools, sql):
+    cursor = tools.cursor(sql)
+    # every row, like fetch_rows
+    names = [c[0] for c in cursor.description]
+    return columnar.read_batches(record_batches(cursor), max_rows=sys.maxsize, names=names)
+
+
+def _top_k(table, column, k=10, descending=True):
+    """The ``k`` rows with the largest (or smallest) ``column``, in order."""
+    order = "descending" if descending else "ascending"
+    return table.take(pc.select_k_unstable(table, k, sort_keys=[(column, order)]))
+
+
+def _group_by(table, keys, aggregations):
+    """``aggregations`` is a list of ``(column, function)``, e.g. ``[("los_days", "mean")]``."""
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    grouped = table.group_by(keys).aggregate(list(aggregations))
+    return grouped.sort_by([(key, "ascending") for key in keys])
+
+
+def _date_buckets(table, column, unit="week", value=None, function="sum"):
+    """Rows (or ``function`` of ``value``) per ``unit`` of ``column``, for a chart.
+
+    ``unit`` is any ``pyarrow.compute.floor_temporal`` unit: day, week
+    (starting Monday), month, quarter or year.
+    """
+    buckets = pc.floor_temporal(table[column], unit=unit)
+    columns = {"bucket": buckets}
+    if value is not None:
+        columns[value] = table[value]
+    bucketed = pyarrow.table(columns)
+    aggregation = (value, function) if value is not None else ("bucket", "count")
+    return _group_by(bucketed, "bucket", [aggregation])
+
+
+def post_process_arrow(table, spec):
+    top = _top_k(table, spec["top"], 10)
+    aggregation = (spec["value"], "mean") if spec["value"] else (spec["group"], "count")
+    grouped = _group_by(table, spec["group"], [aggregation])
+    buckets = _date_buckets(table, spec["date"], unit="week")
+    return top, grouped, buckets, columnar.summary(table)
+
+
+def _best(function, repeat):
+    timings, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000, result
+
+
+def run_benchmark(tools, repeat=3):
+    report = {}
+    for table, spec in WORKLOADS.items():
+        rows_fetch_ms, rows = _best(lambda: fetch_rows(tools, spec["sql"]), repeat)
+        rows_post_ms, _ = _best(lambda: post_process_rows(rows, spec), repeat)
+        arrow_fetch_ms, arrow = _best(lambda: fetch_arrow(tools, spec["sql"]), repeat)
+        arrow_post_ms, _ = _best(lambda: post_process_arrow(arrow, spec), repeat)
+        serialize_ms = {}
+        for mode in ("rows", "arrow"):
+            tools.columnar = mode == "arrow"
+            serialize_ms[mode], _ = _best(lambda: tools.query(spec["sql"]), repeat)
+        tools.columnar = False
+        rows_ms, arrow_ms = rows_fetch_ms + rows_post_ms, arrow_fetch_ms + arrow_post_ms
+        report[table] = {
+            "rows": len(rows),
+            "rows_fetch_ms": rows_fetch_ms,
+            "rows_post_process_ms": rows_post_ms,
+            "arrow_fetch_ms": arrow_fetch_ms,
+            "arrow_post_process_ms": arrow_post_ms,
+            "speedup": rows_ms / arrow_ms if arrow_ms else 0.0,
+            "query_rows_ms": serialize_ms["rows"],
+            "query_arrow_ms": serialize_ms["arrow"],
+        }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=int, default=400, help="copies of each source row")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the fastest counts")
+    parser.add_argument("--save", help="write the report to this path")
+    args = parser.parse_args(argv)
+    if not columnar.available():
+        print("pyarrow is not installed")
+        return 1
+
+    tools = LocalTools()
+    print("scaled rows: " + json.dumps(scale_tables(tools, args.scale)))
+    report = run_benchmark(tools, repeat=args.repeat)
+    print(json.dumps(report, indent=2))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""BigQuery implementation of the tools the orchestrator dispatches to."""
+import collections
+import threading
+
+from google.cloud import bigquery
+
+from cancellation import attached, check
+from columnar import read_batches, serialize_table
+from cost_guard import MAXIMUM_BYTES_BILLED
+from result_cache import normalize_sql
+from serialization import PAGE_SIZE, SCAN_ROWS, serialize_rows
+from singleflight import SingleFlight
+from tracing import current_span, span
+
+KEPT_RESULTS = 500
+# columnar results larger than this are read over the Storage Read API
+STORAGE_API_ROWS = 10 * PAGE_SIZE
+# longest wait for a pooled client when all of them are busy
+CLIENT_TIMEOUT_SECONDS = 30
+
+
+def _millis(start, end):
+    if start is None or end is None:
+        return 0.0
+    return (end - start).total_seconds() * 1000
+
+
+class BigQueryTools:
+    def __init__(self, pool, metadata_cache, result_cache=None, cost_guard=None, columnar=False):
+        self.pool = pool
+        self.columnar = columnar
+        self.flights = SingleFlight()
+        self.metadata_cache = metadata_cache
+        self.result_cache = result_cache
+        self.cost_guard = cost_guard
+        self._destinations = collections.OrderedDict()
+        self._destinations_lock = threading.Lock()
+
+    def list_datasets(self):
+        return self.metadata_cache.list_datasets()
+
+    def list_tables(self, dataset_id):
+        return self.metadata_cache.list_tables(dataset_id)
+
+    def get_table(self, table_id):
+        return self.metadata_cache.get_table(table_id)
+
+    def execute(self, sql):
+        """Run maintenance SQL (DDL/DML) outside the cost guard and result cache."""
+        with self.pool.client(timeout=CLIENT_TIMEOUT_SECONDS) as client:
+            return [tuple(row.values()) for row in client.query(sql).result()]
+
+    def data_version(self, dataset_id):
+        """Newest modification time of any table in ``dataset_id``; changes when data is loaded."""
+        # the rollups are rebuilt from the source tables every hour, they are not new data
+        rows = self.execute(
+            f"SELECT MAX(last_modified_time) FROM `{dataset_id}.__TABLES__` "
+            "WHERE NOT STARTS_WITH(table_id, 'rollup_')"
+        )
+        return rows[0][0] if rows else None
+
+    def _remember_destination(self, sql, destination):
+        if destination is None:
+            return
+        with self._destinations_lock:
+            key = normalize_sql(sql)
+            self._destinations[key] = f"`{destination.project}.{destination.dataset_id}.{destination.table_id}`"
+            self._destinations.move_to_end(key)
+            while len(self._destinations) > KEPT_RESULTS:
+                self._destinations.popitem(last=False)
+
+    def result_handle(self, sql):
+        """Table holding the result of ``sql`` for follow-up queries, or None.
+
+        BigQuery writes every query result to an anonymous table that stays
+        readable for about a day, so a follow-up reads the small result
+        instead of scanning the source tables again.
+        """
+        with self._destinations_lock:
+            return self._destinations.get(normalize_sql(sql))
+
+    def dry_run(self, sql):
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        with self.pool.client(timeout=CLIENT_TIMEOUT_SECONDS) as client:
+            return client.query(sql, job_config=job_config).total_bytes_processed
+
+    def query(self, sql):
+        key = ("query", normalize_sql(sql))
+        # a caller that times out cancels the job; later callers must not join it
+        with attached(lambda: self.flights.forget(key)):
+            # the same query already running for another session: wait for that job
+            return self.flights.do(key, self._query, sql)
+
+    def _query(self, sql):
+        if self.result_cache is not None:
+            cached = self.result_cache.get_query(sql)
+            if cached is not None:
+                if current_span() is not None:
+                    current_span().set(result_cache="hit")
+                return cached
+        submitted = sql
+        if self.cost_guard is not None:
+            # raises QueryRejected, whose message goes back to the model
+            with span("cost_guard"):
+                submitted = self.cost_guard.check(sql, self.dry_run)
+        job_config = bigquery.QueryJobConfig(maximum_bytes_billed=MAXIMUM_BYTES_BILLED)
+        with self.pool.client(timeout=CLIENT_TIMEOUT_SECONDS) as client:
+            check()  # timed out while waiting for a client
+            with span("bigquery.job") as s:
+                query_job = client.query(submitted, job_config=job_config)
+                # a timed-out caller cancels the job: result() raises and the client goes back to the pool
+                with attached(query_job.cancel):
+                    # the columnar path stops after SCAN_ROWS by itself (max_results turns off the Storage API)
+                    max_results = None if self.columnar else SCAN_ROWS
+                    rows = query_job.result(page_size=PAGE_SIZE, max_results=max_results)
+                s.set(
+                    job_id=query_job.job_id,
+                    queue_ms=_millis(query_job.created, query_job.started),
+                    execution_ms=_millis(query_job.started, query_job.ended),
+                    bytes_processed=query_job.total_bytes_processed or 0,
+                    bytes_billed=query_job.total_bytes_billed or 0,
+                    cache_hit=bool(query_job.cache_hit),
+                    rows=rows.total_rows or 0,
+                )
+            check()  # timed out just as the job finished: skip reading the pages
+            names = [field.name for field in rows.schema]
+            if self.columnar:
+                read_client = self.pool.read_client() if (rows.total_rows or 0) > STORAGE_API_ROWS else None
+                table = read_batches(rows.to_arrow_iterable(bqstorage_client=read_client), names=names)
+                result = serialize_table(table, total_rows=rows.total_rows)
+            else:
+                result = serialize_rows(names, (row.values() for row in rows), total_rows=rows.total_rows)
+        self._remember_destination(sql, query_job.destination)
+        if self.cost_guard is not None:
+            self.cost_guard.record_actual(submitted, query_job.total_bytes_billed)
+        if self.result_cache is not None:
+            self.result_cache.put_query(sql, result)
+        return result
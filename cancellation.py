@@ -0,0 +1,91 @@
+"""Stop the work behind a call that timed out, not only the coroutine awaiting it.
+
+``asyncio.wait_for`` gives up on the awaiting coroutine, but a tool running
+in a worker thread (``asyncio.to_thread``) keeps going, and so does the
+BigQuery job or DuckDB statement it started, holding its pool client and
+its single-flight entry. The orchestrator opens a ``CancelScope`` around
+each tool call and Gemini send. ``to_thread`` copies context variables into
+the worker, so the tool finds the scope with ``current_scope()`` and
+registers how to stop what it is running:
+
+    with attached(query_job.cancel):
+        rows = query_job.result()
+
+On timeout the orchestrator calls ``scope.cancel()``: the attached callbacks
+run, and ``check()`` raises ``Cancelled`` in the worker before it starts
+anything new. Outside a scope (scripts, the cache warmer's tools) all of
+this does nothing.
+"""
+import contextlib
+import contextvars
+import threading
+
+_current_scope = contextvars.ContextVar("cancel_scope", default=None)
+
+
+class Cancelled(Exception):
+    pass
+
+
+class CancelScope:
+    def __init__(self):
+        self.cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print("cancel failed: " + str(e))
+
+    def attach(self, callback):
+        """Run ``callback`` on cancel (now, if already cancelled); returns whether it was attached."""
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return True
+        callback()
+        return False
+
+    def detach(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    @contextlib.contextmanager
+    def entered(self):
+        token = _current_scope.set(self)
+        try:
+            yield self
+        finally:
+            _current_scope.reset(token)
+
+
+def current_scope():
+    return _current_scope.get()
+
+
+def check():
+    """Raise ``Cancelled`` if the current call was cancelled."""
+    scope = _current_scope.get()
+    if scope is not None and scope.cancelled:
+        raise Cancelled("the call was cancelled after a timeout")
+
+
+@contextlib.contextmanager
+def attached(callback):
+    """Run ``callback`` if the current call is cancelled while the block runs."""
+    scope = _current_scope.get()
+    if scope is None:
+        yield
+        return
+    scope.attach(callback)
+    try:
+        yield
+    finally:
+        scope.detach(callback)
@@ -0,0 +1,205 @@
+"""Record/replay of Gemini and tool calls.
+
+A cassette is a JSON-lines file of request/response pairs indexed by a hash
+of the request. Recording wraps a live chat and tools object and appends
+every exchange; replaying serves the same exchanges from memory with an
+optional simulated latency and no network at all, so the orchestration code
+can be profiled on its own.
+
+Chat requests are keyed on the whole conversation so far, tool requests on
+the method name and arguments. Identical requests recorded more than once
+are replayed in the order they were recorded.
+
+    CASSETTE_RECORD=cassettes/prod.jsonl streamlit run app.py
+
+records production traffic, and ``prewarm`` loads such a file into the
+metadata and result caches.
+"""
+import asyncio
+import collections
+import hashlib
+import json
+import os
+import threading
+from collections.abc import Mapping
+
+from orchestrator import LlmReply
+
+class CassetteMiss(KeyError):
+    pass
+
+
+def _plain(value):
+    """Turn proto maps and repeated fields from the SDK into JSON types."""
+    if isinstance(value, Mapping):
+        return {str(k): _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)) or (
+        hasattr(value, "__iter__") and not isinstance(value, (str, bytes, dict))
+    ):
+        return [_plain(v) for v in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def request_hash(*parts):
+    payload = json.dumps(_plain(parts), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+class Cassette:
+    def __init__(self, path):
+        self.path = path
+        self._entries = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]].append(entry)
+
+    def record(self, key, kind, request, response, error=None):
+        entry = {"key": key, "kind": kind, "request": _plain(request), "response": _plain(response)}
+        if error is not None:
+            entry["error"] = error
+        with self._lock:
+            self._entries[key].append(entry)
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def play(self, key):
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMiss(key)
+            # later identical requests get the later recordings; the last one repeats
+            return entries.popleft() if len(entries) > 1 else entries[0]
+
+    def entries(self, kind=None):
+        with self._lock:
+            return [e for queue in self._entries.values() for e in queue if kind in (None, e["kind"])]
+
+
+def _reply_to_json(reply):
+    return {"calls": [[name, _plain(args)] for name, args in reply.calls], "text": reply.text}
+
+
+def _reply_from_json(data):
+    return LlmReply(calls=[(name, args) for name, args in data["calls"]], text=data["text"])
+
+
+class _ChatKeys:
+    def __init__(self):
+        self._conversation = ""
+
+    def next_key(self, content):
+        if not isinstance(content, str):
+            content = [[name, response] for name, response in content]
+        self._conversation = request_hash(self._conversation, content)
+        return self._conversation
+
+
+class RecordingChat(_ChatKeys):
+    def __init__(self, chat, cassette):
+        super().__init__()
+        self.chat = chat
+        self.cassette = cassette
+
+    def send(self, content, on_text=None):
+        key = self.next_key(content)
+        reply = self.chat.send(content, on_text)
+        self.cassette.record(key, "llm", content, _reply_to_json(reply))
+        return reply
+
+
+class ReplayChat(_ChatKeys):
+    def __init__(self, cassette, latency=0.0):
+        super().__init__()
+        self.cassette = cassette
+        self.latency = latency
+
+    async def send(self, content, on_text=None):
+        entry = self.cassette.play(self.next_key(content))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        reply = _reply_from_json(entry["response"])
+        if reply.text and on_text is not None:
+            on_text(reply.text)
+        return reply
+
+
+class RecordingTools:
+    def __init__(self, tools, cassette):
+        self.tools = tools
+        self.cassette = cassette
+
+    def __getattr__(self, name):
+        # everything else (dry_run, cost_guard, ...) goes to the wrapped tools
+        return getattr(self.tools, name)
+
+    def _record(self, method, *args):
+        key = request_hash(method, args)
+        try:
+            response = getattr(self.tools, method)(*args)
+        except Exception as e:
+            self.cassette.record(key, "tool", [method, *args], None, error=str(e))
+            raise
+        self.cassette.record(key, "tool", [method, *args], response)
+        return response
+
+    def list_datasets(self):
+        return self._record("list_datasets")
+
+    def list_tables(self, dataset_id):
+        return self._record("list_tables", dataset_id)
+
+    def get_table(self, table_id):
+        return self._record("get_table", table_id)
+
+    def query(self, sql):
+        return self._record("query", sql)
+
+
+class ReplayTools:
+    def __init__(self, cassette, latency=0.0):
+        self.cassette = cassette
+        self.latency = latency
+
+    async def _play(self, method, *args):
+        entry = self.cassette.play(request_hash(method, args))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if "error" in entry:
+            raise RuntimeError(entry["error"])
+        return entry["response"]
+
+    async def list_datasets(self):
+        return await self._play("list_datasets")
+
+    async def list_tables(self, dataset_id):
+        return await self._play("list_tables", dataset_id)
+
+    async def get_table(self, table_id):
+        return await self._play("get_table", table_id)
+
+    async def query(self, sql):
+        return await self._play("query", sql)
+
+
+def prewarm(cassette, metadata_cache=None, result_cache=None):
+    """Load recorded tool responses into the caches; returns how many were loaded."""
+    loaded = 0
+    for entry in cassette.entries("tool"):
+        if "error" in entry:
+            continue
+        method, *args = entry["request"]
+        if method == "query" and result_cache is not None:
+            result_cache.put_query(args[0], entry["response"])
+        elif metadata_cache is not None and method in ("list_datasets", "list_tables", "get_table"):
+            metadata_cache.prime(method, *args, value=entry["response"])
+        else:
+            continue
+        loaded += 1
+    return loaded
@@ -0,0 +1,73 @@
+"""How the Streamlit UI reaches the chat engine.
+
+``LocalEngineClient`` runs the engine in the Streamlit process (the default,
+and what ``QUERY_BACKEND=local`` development uses). ``HttpEngineClient``
+talks to ``api.py`` when ``CHAT_API_URL`` is set. Both have the same two
+blocking methods, so the UI does not know which one it has.
+"""
+import asyncio
+import json
+
+DEFAULT_TIMEOUT_SECONDS = 180
+# the sidebar asks for stats on every rerun; a stalled API must not hold up the page
+STATS_TIMEOUT_SECONDS = 3
+
+
+class LocalEngineClient:
+    """``get_engine`` is called when a question is asked, so the page can paint while it starts."""
+
+    def __init__(self, get_engine, ready=None):
+        self._get_engine = get_engine
+        self._ready = ready or (lambda: True)
+
+    @property
+    def engine(self):
+        return self._get_engine()
+
+    def ask(self, session_id, question, on_text=None, preinject_schema=True):
+        return asyncio.run(
+            self.engine.ask(session_id, question, on_text=on_text, preinject_schema=preinject_schema)
+        )
+
+    def stats(self):
+        if not self._ready():
+            return {"backend": "starting"}
+        return self.engine.stats()
+
+
+class HttpEngineClient:
+    def __init__(self, url, timeout=DEFAULT_TIMEOUT_SECONDS, stats_timeout=STATS_TIMEOUT_SECONDS):
+        import requests
+
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.stats_timeout = stats_timeout
+        self._session = requests.Session()
+
+    def ask(self, session_id, question, on_text=None, preinject_schema=True):
+        body = {"session_id": session_id, "question": question, "preinject_schema": preinject_schema}
+        with self._session.post(
+            self.url + "/v1/ask/stream", json=body, stream=True, timeout=self.timeout
+        ) as response:
+            response.raise_for_status()
+            text = ""
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event["type"] == "text":
+                    text += event["delta"]
+                    if on_text is not None:
+                        on_text(text)
+                elif event["type"] == "reset":
+                    text = ""
+                    if on_text is not None:
+                        on_text(text)
+                elif event["type"] == "answer":
+                    return event
+        raise RuntimeError("chat API closed the stream without an answer")
+
+    def stats(self):
+        response = self._session.get(self.url + "/v1/stats", timeout=self.stats_timeout)
+        response.raise_for_status()
+        return response.json()["engine"]
@@ -0,0 +1,100 @@
+"""Columnar query results: Arrow record batches instead of one Python object per row.
+
+Both backends can hand results over as Arrow record batches (BigQuery via
+``RowIterator.to_arrow_iterable``, through the Storage Read API for large
+results; DuckDB via ``fetch_record_batch``). ``read_batches`` collects them
+into one ``pyarrow.Table`` and everything after that is vectorized:
+
+- ``serialize_table`` writes the same text as ``serialization.serialize_rows``
+  but only converts the rows it shows; like the row path it reads at most
+  ``SCAN_ROWS`` rows for the summary stats and counts the rest
+- ``summary`` computes those stats with ``pyarrow.compute`` kernels
+
+``QUERY_FETCH=arrow`` selects this path. ``benchmark_fetch.py`` compares it
+with the row-by-row path.
+"""
+from serialization import MAX_BYTES, MAX_ROWS, SCAN_ROWS, ResultWriter, _format_value
+from tracing import span
+
+try:
+    import pyarrow
+    import pyarrow.compute as pc
+except ImportError:  # only needed for QUERY_FETCH=arrow
+    pyarrow = pc = None
+
+
+def available():
+    return pyarrow is not None
+
+
+def read_batches(batches, max_rows=SCAN_ROWS, names=()):
+    """One table from an iterable of record batches, stopping after ``max_rows``.
+
+    ``names`` are the columns of an empty result, which may come without batches.
+    """
+    kept, rows = [], 0
+    for batch in batches:
+        if rows >= max_rows:
+            break
+        if rows + batch.num_rows > max_rows:
+            batch = batch.slice(0, max_rows - rows)
+        kept.append(batch)
+        rows += batch.num_rows
+    if not kept:
+        return pyarrow.table({name: pyarrow.array([]) for name in names})
+    return pyarrow.Table.from_batches(kept)
+
+
+def _is_numeric(type_):
+    return pyarrow.types.is_integer(type_) or pyarrow.types.is_floating(type_) or pyarrow.types.is_decimal(type_)
+
+
+def _is_temporal(type_):
+    return pyarrow.types.is_date(type_) or pyarrow.types.is_timestamp(type_)
+
+
+def summary(table):
+    """``{column: {"min", "max", "mean", "nulls"}}`` for numeric and date columns."""
+    stats = {}
+    for name, column in zip(table.column_names, table.columns):
+        numeric, temporal = _is_numeric(column.type), _is_temporal(column.type)
+        if not (numeric or temporal):
+            continue
+        minmax = pc.min_max(column)
+        stats[name] = {
+            "min": minmax["min"].as_py(),
+            "max": minmax["max"].as_py(),
+            "mean": pc.mean(column).as_py() if numeric else None,
+            "nulls": column.null_count,
+        }
+    return stats
+
+
+def _describe(name, stats):
+    # same wording as serialization._ColumnStats.describe
+    if stats["min"] is None:
+        return None
+    parts = [f"min={_format_value(stats['min'])}", f"max={_format_value(stats['max'])}"]
+    if stats["mean"] is not None:
+        parts.append(f"avg={_format_value(float(stats['mean']))}")
+    if stats["nulls"]:
+        parts.append(f"nulls={stats['nulls']}")
+    return f"{name} " + " ".join(parts)
+
+
+def serialize_table(table, total_rows=None, max_rows=MAX_ROWS, max_bytes=MAX_BYTES):
+    """Serialize a ``pyarrow.Table`` like ``serialize_rows`` serializes tuples."""
+    with span("serialize") as s:
+        writer = ResultWriter(table.column_names, max_rows=max_rows, max_bytes=max_bytes)
+        head = table.slice(0, max_rows)
+        for values in zip(*(column.to_pylist() for column in head.columns)):
+            writer.append(values)
+        stats = summary(table)
+        text = writer.finish(
+            total_rows,
+            scanned=table.num_rows,
+            described=[_describe(name, stats[name]) if name in stats else None for name in table.column_names],
+        )
+        s.set(rows=table.num_rows, rows_written=writer.rows_written, bytes=len(text), columnar=True)
+    return text
+
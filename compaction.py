@@ -0,0 +1,95 @@
+"""Fewer input tokens per turn: compact tool responses and per-turn token counts.
+
+``get_table`` used to hand the model ``str()`` of the whole table resource
+(etags, self links, timestamps, location, ...). ``compact_table`` keeps what
+the model needs to write SQL: the table name, row count, description,
+partitioning/clustering and ``name TYPE`` per column. A ``SchemaLedger``
+lives for one turn and replaces a table the model has already been given
+(in the schema digest or an earlier ``get_table``) with a one-line
+reference.
+
+``TokenRecorder`` keeps the prompt, cached and output token counts Gemini
+reports for every turn.
+"""
+import collections
+import re
+import threading
+
+from metadata_cache import normalize_table_id
+from schema_context import percentile
+
+_DIGEST_TABLE = re.compile(r"^- (\w+\.\w+)\(", re.MULTILINE)
+
+
+def compact_table(resource, table_id=None):
+    reference = resource.get("tableReference")
+    if reference:
+        table_id = f"{reference['datasetId']}.{reference['tableId']}"
+    else:
+        table_id = normalize_table_id(table_id or resource.get("id", "").replace(":", "."))
+    facts = []
+    if resource.get("numRows") is not None:
+        facts.append(f"{resource['numRows']} rows")
+    partitioning = resource.get("timePartitioning") or {}
+    if partitioning:
+        facts.append(f"partitioned by {partitioning.get('field', '_PARTITIONTIME')}")
+    clustering = (resource.get("clustering") or {}).get("fields")
+    if clustering:
+        facts.append(f"clustered by {', '.join(clustering)}")
+    columns = []
+    for field in resource.get("schema", {}).get("fields", []):
+        column = f"{field['name']} {field.get('type', 'STRING')}"
+        if field.get("mode") == "REPEATED":
+            column += " REPEATED"
+        if field.get("description"):
+            column += f" -- {field['description']}"
+        columns.append(column)
+    text = f"{table_id}" + (f" ({'; '.join(facts)})" if facts else "")
+    if resource.get("description"):
+        text += f": {resource['description']}"
+    return text + "\ncolumns: " + ", ".join(columns)
+
+
+def digest_tables(digest):
+    """Tables whose columns a schema digest already lists."""
+    return {normalize_table_id(t) for t in _DIGEST_TABLE.findall(digest or "")}
+
+
+class SchemaLedger:
+    def __init__(self, known_tables=()):
+        self.sent = {normalize_table_id(t) for t in known_tables}
+        self.deduplicated = 0
+
+    def describe(self, table_id, resource):
+        table_id = normalize_table_id(table_id)
+        if table_id in self.sent:
+            self.deduplicated += 1
+            return f"{table_id}: the columns are already listed above, call sql_query."
+        self.sent.add(table_id)
+        return compact_table(resource, table_id)
+
+
+class TokenRecorder:
+    def __init__(self, maxlen=500):
+        self._samples = collections.deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, tokens):
+        if tokens:
+            with self._lock:
+                self._samples.append(dict(tokens))
+
+    def summary(self):
+        with self._lock:
+            samples = list(self._samples)
+        prompt = [s.get("prompt", 0) for s in samples]
+        return {
+            "turns": len(samples),
+            "avg_prompt": sum(prompt) / len(prompt) if prompt else 0.0,
+            "p95_prompt": percentile(prompt, 95),
+            "avg_cached": sum(s.get("cached", 0) for s in samples) / len(samples) if samples else 0.0,
+            "avg_output": sum(s.get("output", 0) for s in samples) / len(samples) if samples else 0.0,
+        }
+
+
+token_recorder = TokenRecorder()
@@ -0,0 +1,120 @@
+"""Context carried from one chat turn to the next within a session.
+
+Every message starts a new Gemini chat, so without this a follow-up like
+"now break that down by department_name" has to rediscover the schema and
+rebuild the base query. ``ConversationContext`` keeps the last few answered
+questions with their SQL and a handle to the result: the table BigQuery
+already wrote it to, or a materialized table on the local backend.
+``preamble`` puts that in front of the next prompt so the model can refine
+the SQL or query the small result table instead of scanning again.
+
+The whole Gemini chat is deliberately not kept: its history holds every
+raw tool response and would grow the prompt on each turn.
+
+``SessionStore`` keeps the context between requests in one of the
+``result_cache`` backends, so any API worker can serve any session.
+"""
+import collections
+import csv
+import dataclasses
+import io
+import re
+
+from result_cache import InMemoryBackend
+
+MAX_TURNS = 3
+MAX_ANSWER_CHARS = 400
+SESSION_TTL_SECONDS = 4 * 60 * 60
+
+_FOLLOW_UP = re.compile(
+    r"\b(that|those|these|them|it|its|same|previous|above|instead|now|break\w*\s+\w+\s+down|drill\w*)\b",
+    re.IGNORECASE,
+)
+
+
+@dataclasses.dataclass
+class Turn:
+    question: str
+    sql: str
+    handle: str = None
+    columns: list = dataclasses.field(default_factory=list)
+    answer: str = ""
+
+
+def _columns(response):
+    """Column names from the header line of a ``serialize_rows`` result."""
+    header = str(response).split("\n", 1)[0]
+    return next(csv.reader(io.StringIO(header)), [])
+
+
+class ConversationContext:
+    def __init__(self, max_turns=MAX_TURNS):
+        self.turns = collections.deque(maxlen=max_turns)
+
+    def record(self, question, result, tools):
+        """Keep a successful turn that ran SQL, with a handle to its result."""
+        if result.failed or not result.last_sql:
+            return None
+        calls = [c for c in result.calls if c.name == "sql_query" and not c.error]
+        handle = None
+        result_handle = getattr(tools, "result_handle", None)
+        if result_handle is not None:
+            try:
+                handle = result_handle(result.last_sql)
+            except Exception as e:
+                print("result handle unavailable: " + str(e))
+        answer = " ".join(result.answer.split())
+        turn = Turn(
+            question=question,
+            sql=result.last_sql,
+            handle=handle,
+            columns=_columns(calls[-1].response) if calls else [],
+            answer=answer[:MAX_ANSWER_CHARS] + ("…" if len(answer) > MAX_ANSWER_CHARS else ""),
+        )
+        self.turns.append(turn)
+        return turn
+
+    def to_dict(self):
+        return {"turns": [dataclasses.asdict(turn) for turn in self.turns]}
+
+    @classmethod
+    def from_dict(cls, data, max_turns=MAX_TURNS):
+        context = cls(max_turns)
+        for turn in (data or {}).get("turns", []):
+            context.turns.append(Turn(**turn))
+        return context
+
+    def is_follow_up(self, question):
+        return bool(self.turns) and bool(_FOLLOW_UP.search(question))
+
+    def preamble(self):
+        if not self.turns:
+            return ""
+        lines = ["Earlier in this conversation (most recent last):"]
+        for turn in self.turns:
+            lines.append(f"- Question: {turn.question}")
+            lines.append(f"  SQL: {turn.sql}")
+            if turn.handle:
+                # a turn answered from the cache has no columns at hand
+                columns = f" (columns: {', '.join(turn.columns)})" if turn.columns else ""
+                lines.append(f"  Its full result is saved as table {turn.handle}{columns}.")
+            lines.append(f"  Answer: {turn.answer}")
+        lines.append(
+            "If the new question refines one of these, adapt its SQL, or query its saved result table "
+            "when that table has the columns you need; do not rediscover the schema."
+        )
+        return "\n".join(lines)
+
+
+class SessionStore:
+    """Conversation context by session id, in any ``result_cache`` backend."""
+
+    def __init__(self, backend=None, ttl_seconds=SESSION_TTL_SECONDS):
+        self.backend = backend or InMemoryBackend()
+        self.ttl_seconds = ttl_seconds
+
+    def load(self, session_id):
+        return ConversationContext.from_dict(self.backend.get(session_id))
+
+    def save(self, session_id, context):
+        self.backend.set(session_id, context.to_dict(), self.ttl_seconds)
@@ -0,0 +1,150 @@
+"""Pre-execution cost check for the SQL the model sends to sql_query.
+
+Before a query is submitted its bytes scanned are estimated, first from the
+cached table sizes and, when that upper bound is not clearly cheap, with a
+BigQuery dry run. Queries over the billing limit, or unfiltered scans of
+large tables that have date columns, are rejected with a hint the model can
+act on instead of failing as a billed job. Row queries without a LIMIT get
+one appended. Estimated and actual bytes are logged side by side.
+
+The guard does not rewrite queries onto partitions: an unfiltered scan is
+rejected with the date columns to filter on, and the model adds the filter.
+"""
+import collections
+import re
+import threading
+
+from result_cache import normalize_sql
+
+MAXIMUM_BYTES_BILLED = 100000000
+# metadata upper bounds below this skip the dry run round trip
+DRY_RUN_THRESHOLD_BYTES = 10000000
+# scans this large must filter on a date column
+UNFILTERED_SCAN_BYTES = 50000000
+DEFAULT_LIMIT = 1000
+USD_PER_TIB = 6.25
+# estimates kept for jobs that have not reported their billed bytes yet
+PENDING_ESTIMATES = 500
+
+_TABLE_REF = re.compile(r"\b(?:FROM|JOIN)\s+`?(?:[\w-]+\.)?(\w+)\.(\w+)`?", re.IGNORECASE)
+_AGGREGATE = re.compile(r"\b(COUNT|SUM|AVG|MIN|MAX|COUNTIF|APPROX_COUNT_DISTINCT)\s*\(", re.IGNORECASE)
+_GROUP_BY = re.compile(r"\bGROUP\s+BY\b", re.IGNORECASE)
+_LIMIT = re.compile(r"\bLIMIT\s+\d+(\s+OFFSET\s+\d+)?\s*$", re.IGNORECASE)
+_WHERE = re.compile(r"\bWHERE\b(.*)", re.IGNORECASE | re.DOTALL)
+
+
+class QueryRejected(Exception):
+    pass
+
+
+def referenced_tables(sql):
+    return sorted({f"{dataset}.{table}" for dataset, table in _TABLE_REF.findall(sql)})
+
+
+def needs_limit(sql):
+    if _LIMIT.search(sql):
+        return False
+    # a plain aggregate returns one row
+    return not (_AGGREGATE.search(sql) and not _GROUP_BY.search(sql))
+
+
+def bytes_to_usd(num_bytes):
+    return num_bytes / 2 ** 40 * USD_PER_TIB
+
+
+class CostGuard:
+    def __init__(self, metadata_cache=None, maximum_bytes_billed=MAXIMUM_BYTES_BILLED,
+                 dry_run_threshold=DRY_RUN_THRESHOLD_BYTES,
+                 unfiltered_scan_bytes=UNFILTERED_SCAN_BYTES, default_limit=DEFAULT_LIMIT):
+        self.metadata_cache = metadata_cache
+        self.maximum_bytes_billed = maximum_bytes_billed
+        self.dry_run_threshold = dry_run_threshold
+        self.unfiltered_scan_bytes = unfiltered_scan_bytes
+        self.default_limit = default_limit
+        self._estimates = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.log = collections.deque(maxlen=500)
+        self.counters = collections.Counter()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _table_info(self, table_id):
+        if self.metadata_cache is None:
+            return None
+        try:
+            return self.metadata_cache.get_table(table_id)
+        except Exception:
+            return None
+
+    def check(self, sql, dry_run):
+        """Return the SQL to submit, or raise ``QueryRejected``.
+
+        ``dry_run(sql)`` returns the bytes BigQuery would process.
+        """
+        sql = sql.strip().rstrip(";")
+        tables = {table_id: self._table_info(table_id) for table_id in referenced_tables(sql)}
+
+        estimated = None
+        if tables and all(info is not None for info in tables.values()):
+            upper_bound = sum(int(info.get("numBytes", 0)) for info in tables.values())
+            if upper_bound < self.dry_run_threshold:
+                estimated = upper_bound
+                self._count("dry_runs_skipped")
+        if estimated is None:
+            estimated = dry_run(sql)
+            self._count("dry_runs")
+
+        if estimated > self.maximum_bytes_billed:
+            self._count("rejected")
+            raise QueryRejected(
+                f"Query not run: it would scan {estimated} bytes, over the "
+                f"{self.maximum_bytes_billed} byte limit. Select fewer columns and filter on a date column."
+            )
+        if estimated > self.unfiltered_scan_bytes:
+            where = _WHERE.search(sql)
+            where = where.group(1).lower() if where else ""
+            for table_id, info in tables.items():
+                date_columns = [
+                    f["name"] for f in (info or {}).get("schema", {}).get("fields", [])
+                    if f.get("type") in ("DATE", "DATETIME", "TIMESTAMP")
+                ]
+                if date_columns and not any(c.lower() in where for c in date_columns):
+                    self._count("rejected")
+                    raise QueryRejected(
+                        f"Query not run: it scans all of {table_id} ({estimated} bytes). "
+                        f"Add a WHERE filter on {' or '.join(date_columns)}."
+                    )
+
+        if needs_limit(sql):
+            sql = f"{sql} LIMIT {self.default_limit}"
+            self._count("limit_added")
+        key = normalize_sql(sql)
+        with self._lock:
+            # a job that fails never calls record_actual
+            self._estimates[key] = estimated
+            self._estimates.move_to_end(key)
+            while len(self._estimates) > PENDING_ESTIMATES:
+                self._estimates.popitem(last=False)
+        return sql
+
+    def record_actual(self, sql, bytes_billed):
+        with self._lock:
+            estimated = self._estimates.pop(normalize_sql(sql), None)
+        entry = {
+            "sql": sql,
+            "estimated_bytes": estimated,
+            "billed_bytes": bytes_billed or 0,
+            "billed_usd": bytes_to_usd(bytes_billed or 0),
+        }
+        self.log.append(entry)
+        print(
+            f"query cost: estimated {estimated} bytes, billed {entry['billed_bytes']} bytes "
+            f"(${entry['billed_usd']:.6f})"
+        )
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
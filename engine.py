@@ -0,0 +1,509 @@
+"""The chat engine, independent of any UI.
+
+Everything a chat turn needs (tool declarations, model, tools backend,
+caches, rollups, templates, orchestrator) is built once per process by
+``get_engine``, and ``ChatEngine.ask`` answers one question for one
+session. The conversation context of a session lives in a ``SessionStore``
+(``SESSION_STORE_URL=redis://...`` shares it), so workers keep no session
+state of their own and any of them can serve the next question.
+
+Importing this module is cheap: the Vertex AI and BigQuery SDKs are imported
+when the engine is built, and ``start_engine`` builds it in a background
+thread so a new instance paints its page (or answers health checks)
+meanwhile. ``startup_profile.py`` shows where startup time goes.
+
+``api.py`` serves the engine over HTTP; ``app.py`` uses it in process or,
+with ``CHAT_API_URL`` set, through the API.
+"""
+import asyncio
+import dataclasses
+import json
+import os
+import threading
+import time
+
+from cassette import Cassette, RecordingChat, RecordingTools, prewarm
+from conversation import ConversationContext, SessionStore
+from compaction import digest_tables, token_recorder
+from cost_guard import CostGuard
+from intents import TemplateMatcher
+from metadata_cache import DEFAULT_TTL_SECONDS, get_metadata_cache
+from orchestrator import CANNOT_FULFILL, Orchestrator, TurnResult, format_backend_details
+from policy import ExecutionPolicy
+from resources import get_bigquery_pool, get_cached_model, get_model
+from result_cache import ResultCache, backend_from_url
+from rollups import ROLLUP_HINTS, RollupManager, route
+from schema_context import build_schema_digest, round_trip_recorder
+from singleflight import SingleFlight
+from streaming import GeminiChat, ttft_recorder
+from tracing import span, tracer, waterfall
+from warmer import CacheWarmer, QueryLog, parse_times
+
+BIGQUERY_DATASET_ID = "UDMH"
+GCP_PROJECT_ID= "asc-colabathon"
+TURN_TIMEOUT_SECONDS = 120
+# "local" answers from UDMH_dummyData.zip in process, without BigQuery
+QUERY_BACKEND = os.environ.get("QUERY_BACKEND", "bigquery")
+# "arrow" reads results as record batches (needs pyarrow) instead of row by row
+QUERY_FETCH = os.environ.get("QUERY_FETCH", "rows")
+# record every Gemini/tool exchange to this cassette, or pre-load caches from one
+CASSETTE_RECORD = os.environ.get("CASSETTE_RECORD")
+CASSETTE_PREWARM = os.environ.get("CASSETTE_PREWARM")
+# GEMINI_CONTEXT_CACHE=1 serves the instructions, schema digest and tools from a Vertex context cache
+GEMINI_CONTEXT_CACHE = os.environ.get("GEMINI_CONTEXT_CACHE") == "1"
+MODEL_NAME = "gemini-2.0-flash"  # "gemini-1.5-pro-001"
+GENERATION_CONFIG = {"temperature": 0}
+# ROLLUP_REFRESH=1 builds the rollup tables in the dataset and routes queries onto them;
+# off by default, since it needs write access and each instance that has it rebuilds them
+ROLLUP_REFRESH = os.environ.get("ROLLUP_REFRESH") == "1"
+# rebuild the rollup tables (incrementally) this often
+ROLLUP_REFRESH_SECONDS = int(os.environ.get("ROLLUP_REFRESH_SECONDS", 60 * 60))
+# metadata from the last start, so a new instance does not wait for BigQuery before serving
+STARTUP_SNAPSHOT = os.environ.get("STARTUP_SNAPSHOT")
+# answered questions, mined by the cache warmer; CACHE_WARM_AT="06:00,12:30" turns warming on
+QUERY_LOG = os.environ.get("QUERY_LOG")
+CACHE_WARM_AT = os.environ.get("CACHE_WARM_AT")
+
+INSTRUCTIONS = """
+            Please give a concise, high-level summary followed by detail in
+            plain language about where the information in your response is
+            coming from in the database. Only use information that you learn
+            from BigQuery, do not make up information.
+            """
+
+list_datasets_func = dict(
+    name="list_datasets",
+    description="Get a list of datasets",
+    parameters={
+        "type": "object",
+        "properties": {},
+    },
+)
+
+list_tables_func = dict(
+    name="list_tables",
+    description="List tables in all the datasets from the array of datasets given in arguments",
+    parameters={
+        "type": "object",
+        "properties": {
+            "dataset_id": {
+                "type": "array",
+                "description": "Dataset ID to fetch tables from.",
+            }
+        },
+        "required": [
+            "dataset_id",
+        ],
+    },
+)
+
+get_table_func = dict(
+    name="get_table",
+    description="""Get information about a table, including the description, schema, and number of rows that will help answer the user's question.
+        Always use the fully qualified dataset and table names.""",
+    parameters={
+        "type": "object",
+        "properties": {
+            "table_id": {
+                "type": "string",
+                "description": "Fully qualified ID of the table to get information about",
+            }
+        },
+        "required": [
+            "table_id",
+        ],
+    },
+)
+
+sql_query_func = dict(
+    name="sql_query",
+    description="""Run a BigQuery SQL query and return the rows. Default dataset: UDMH.
+        patient_dim: patients. gender for sex, dob is date of birth, address is "street, city, state, zip", first_name and last_name.
+        provider_dim: providers. first_name and last_name.
+        clncl_ordr_dim: clinical orders providers placed for patients. order_type is Medication, Lab, Imaging or Surgery. order_date for all date filters.
+        encounter_dim: encounters/visits/hospital stays. Days stayed is discharge_date - admission_date. reason is the encounter reason. department_name is Emergency, Outpatient, Inpatient, ICU, Pharmacy, Radiology or Laboratory.
+        medication_dim: medication details.
+        Join on patient_id with patient_dim and provider_id with provider_dim.
+        """,
+    parameters={
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": "One-line BigQuery SQL query using fully qualified dataset.table names.",
+            }
+        },
+        "required": [
+            "query",
+        ],
+    },
+)
+
+_sql_query_tool = None
+_sql_query_tool_lock = threading.Lock()
+
+
+def sql_query_tool():
+    """The Gemini ``Tool`` with the declarations above, built once per process."""
+    global _sql_query_tool
+    with _sql_query_tool_lock:
+        if _sql_query_tool is None:
+            from vertexai.generative_models import FunctionDeclaration, Tool
+
+            _sql_query_tool = Tool(
+                function_declarations=[
+                    FunctionDeclaration(**declaration)
+                    for declaration in (list_datasets_func, list_tables_func, get_table_func, sql_query_func)
+                ],
+            )
+        return _sql_query_tool
+
+
+def _start_rollups(tools):
+    # built (or caught up) in the background, then refreshed incrementally;
+    # queries are routed onto them once the first refresh is done
+    rollups = RollupManager(tools, BIGQUERY_DATASET_ID)
+
+    def refresh():
+        try:
+            print("rollups: " + str(rollups.refresh()))
+        except Exception as e:
+            print("rollup refresh failed: " + str(e))
+
+    def loop():
+        while True:
+            refresh()
+            time.sleep(ROLLUP_REFRESH_SECONDS)
+
+    threading.Thread(target=loop, daemon=True).start()
+    return rollups
+
+
+class ChatEngine:
+    def __init__(
+        self,
+        model,
+        tools,
+        result_cache,
+        sessions,
+        dataset_id=BIGQUERY_DATASET_ID,
+        cassette=None,
+        turn_timeout=TURN_TIMEOUT_SECONDS,
+        backend=QUERY_BACKEND,
+        metadata_cache=None,
+        bigquery_pool=None,
+        context_cache=GEMINI_CONTEXT_CACHE,
+        rollups=None,
+        query_log=None,
+    ):
+        self.model = model
+        self.tools = tools
+        self.result_cache = result_cache
+        self.sessions = sessions
+        self.dataset_id = dataset_id
+        self.cassette = cassette
+        self.turn_timeout = turn_timeout
+        self.backend = backend
+        self.metadata_cache = metadata_cache
+        self.bigquery_pool = bigquery_pool
+        self.context_cache = context_cache
+        self.rollups = rollups
+        self.query_log = query_log or QueryLog()
+        self.warmer = None
+        self.flights = SingleFlight()
+        self.orchestrator = Orchestrator(tools, router=self._route, policy=ExecutionPolicy(tools, dataset_id))
+        self.templates = TemplateMatcher(tools, dataset_id, router=self._route)
+        self.startup = None
+        self._digest = None
+        self._digest_expires = 0.0
+        self._digest_rollups = False
+        self._digest_lock = threading.Lock()
+
+    def _rollups_ready(self):
+        # only after a refresh in this process succeeded: until then the tables may not exist
+        return self.rollups is not None and self.rollups.refreshed_at is not None
+
+    def _route(self, sql):
+        return route(sql, self.dataset_id) if self._rollups_ready() else None
+
+    def schema_digest(self):
+        # both tool backends serve list_tables/get_table from memory
+        with self._digest_lock:
+            ready = self._rollups_ready()
+            if self._digest is None or time.monotonic() > self._digest_expires or ready != self._digest_rollups:
+                self._digest = build_schema_digest(self.tools, self.dataset_id)
+                if ready:
+                    self._digest += "\n" + ROLLUP_HINTS
+                self._digest_rollups = ready
+                self._digest_expires = time.monotonic() + DEFAULT_TTL_SECONDS
+            return self._digest
+
+    def warm_up(self):
+        """Do the work of a first question ahead of it: schema digest and context cache."""
+        digest = self.schema_digest()
+        if self.context_cache:
+            get_cached_model(
+                MODEL_NAME, digest + INSTRUCTIONS, [sql_query_tool()], DEFAULT_TTL_SECONDS,
+                generation_config=GENERATION_CONFIG,
+            )
+
+    async def ask(self, session_id, question, on_text=None, preinject_schema=True, refresh=False):
+        """Answer ``question`` in ``session_id``; ``on_text`` gets the partial answer as it streams.
+
+        ``session_id=None`` answers without any conversation context, and
+        ``refresh`` skips the answer cache (the cache warmer uses both).
+        """
+        with span("chat_turn", session_id=session_id) as turn_span:
+            turn_started = time.perf_counter()
+            if session_id is None:
+                conversation = ConversationContext()
+            else:
+                conversation = await asyncio.to_thread(self.sessions.load, session_id)
+
+            mode = "discovery"
+            model, prefix, instructions, known_tables = self.model, "", INSTRUCTIONS, ()
+            if preinject_schema:
+                try:
+                    digest = await asyncio.to_thread(self.schema_digest)
+                    known_tables = digest_tables(digest)
+                    mode = "preinjected"
+                    cached_model = None
+                    if self.context_cache:
+                        cached_model = await asyncio.to_thread(
+                            get_cached_model, MODEL_NAME, digest + INSTRUCTIONS, [sql_query_tool()],
+                            DEFAULT_TTL_SECONDS, generation_config=GENERATION_CONFIG,
+                        )
+                    if cached_model is not None:
+                        # the digest and instructions are the cached system instruction
+                        model, instructions = cached_model, ""
+                    else:
+                        prefix = digest + "\n\n"
+                except Exception as e:
+                    print("schema digest unavailable: " + str(e))
+            prompt = prefix + question + instructions
+
+            follow_up = conversation.is_follow_up(question)
+            if conversation.turns:
+                # prior SQL and result tables let follow-ups refine instead of starting over
+                prompt = conversation.preamble() + "\n\n" + prompt
+                if follow_up:
+                    mode = "follow_up"
+
+            result = None
+            template = self.templates.match(question)
+            if template is not None:
+                # a known question pattern, one templated query instead of the model loop
+                result = await self.templates.run(template)
+                if result is not None:
+                    mode = "template"
+            # "break that down" means something different in every conversation
+            cached_answer = None
+            if result is None and not follow_up and not refresh:
+                cached_answer = await asyncio.to_thread(self.result_cache.get_answer, question)
+            if cached_answer is not None:
+                # a near-duplicate question was answered before, skip the model entirely
+                mode = "cached"
+                # with its SQL, so the turn is recorded and a follow-up can refine it
+                result = TurnResult(answer=cached_answer["answer"], last_sql=cached_answer["sql"])
+            elif result is None:
+                ran = False
+
+                async def run_model():
+                    nonlocal ran
+                    ran = True
+                    chat = GeminiChat(model.start_chat())
+                    if self.cassette is not None:
+                        chat = RecordingChat(chat, self.cassette)
+                    try:
+                        # cancelling the run also cancels the queries and the stream it is waiting on
+                        return await asyncio.wait_for(
+                            self.orchestrator.run(chat, prompt, on_text=on_text, known_tables=known_tables),
+                            self.turn_timeout,
+                        )
+                    except asyncio.TimeoutError:
+                        return TurnResult(answer=CANNOT_FULFILL, failed=True)
+
+                # the same prompt is being answered for another user right now: share that turn
+                result = await self.flights.do_async(("turn", prompt), run_model)
+                if not ran:
+                    mode = "coalesced"
+                    # the tokens were spent (and counted) once, by the turn that ran
+                    result = dataclasses.replace(result, tokens={})
+                    if on_text is not None:
+                        on_text(result.answer)
+                elif not result.failed and not follow_up:
+                    await asyncio.to_thread(
+                        self.result_cache.put_answer, question, result.last_sql, result.answer
+                    )
+
+            turn_span.set(mode=mode, round_trips=result.round_trips, failed=result.failed, **{
+                key + "_tokens": count for key, count in result.tokens.items()
+            })
+            token_recorder.record(result.tokens)
+            round_trip_recorder.record(mode, result.round_trips, time.perf_counter() - turn_started)
+            ttft_recorder.record((result.first_token_at or time.perf_counter()) - turn_started)
+
+            if not result.failed and not follow_up and not refresh:
+                self.query_log.record(question, result.last_sql, mode)
+            if session_id is not None:
+                await asyncio.to_thread(conversation.record, question, result, self.tools)
+                await asyncio.to_thread(self.sessions.save, session_id, conversation)
+
+        return {
+            "session_id": session_id,
+            "answer": result.answer,
+            "sql": result.last_sql,
+            "mode": mode,
+            "round_trips": result.round_trips,
+            "tokens": result.tokens,
+            "failed": result.failed,
+            "backend_details": format_backend_details(result.calls),
+            "trace_id": turn_span.trace_id,
+            "timeline": waterfall(tracer.trace(turn_span.trace_id)),
+            "seconds": time.perf_counter() - turn_started,
+        }
+
+    def stats(self):
+        stats = {
+            "backend": self.backend,
+            "templates": self.templates.stats(),
+            "result_cache": self.result_cache.stats(),
+            "ttft": ttft_recorder.summary(),
+            "tokens": token_recorder.summary(),
+            "round_trips": round_trip_recorder.summary(),
+        }
+        if self.startup is not None:
+            stats["startup_seconds"] = self.startup["seconds"]
+        if self.metadata_cache is not None:
+            stats["metadata_cache"] = self.metadata_cache.stats()
+        if self.bigquery_pool is not None:
+            stats["bigquery_pool"] = self.bigquery_pool.stats()
+        cost_guard = getattr(self.tools, "cost_guard", None)
+        if cost_guard is not None:
+            stats["cost_guard"] = cost_guard.stats()
+        if self.warmer is not None:
+            stats["cache_warmer"] = self.warmer.stats()
+        stats["single_flight"] = {"turns": self.flights.stats()}
+        if getattr(self.tools, "flights", None) is not None:
+            stats["single_flight"]["queries"] = self.tools.flights.stats()
+        if self.metadata_cache is not None:
+            stats["single_flight"]["metadata"] = self.metadata_cache.flights.stats()
+        return stats
+
+
+def _load_snapshot(metadata_cache, path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return metadata_cache.restore(json.load(f)["metadata"])
+    except (OSError, ValueError, KeyError) as e:
+        print("startup snapshot unavailable: " + str(e))
+        return 0
+
+
+def _warm_metadata(metadata_cache, snapshot_path=None):
+    try:
+        metadata_cache.warm([BIGQUERY_DATASET_ID])
+    except Exception as e:
+        print("metadata warm-up failed: " + str(e))
+        return
+    if snapshot_path:
+        # written next to the target and renamed, so a starting instance never reads half a file
+        partial = snapshot_path + ".partial"
+        with open(partial, "w", encoding="utf-8") as f:
+            json.dump({"metadata": metadata_cache.snapshot()}, f)
+        os.replace(partial, snapshot_path)
+
+
+def build_engine():
+    with span("startup") as startup:
+        with span("startup.vertexai"):
+            import vertexai
+
+            vertexai.init(
+                project="asc-colabathon",
+                location="us-central1"
+            )
+            model = get_model(MODEL_NAME, generation_config=GENERATION_CONFIG, tools=[sql_query_tool()])
+        # RESULT_CACHE_URL=redis://localhost:6379/0 shares the cache between instances
+        result_cache = ResultCache(backend_from_url(os.environ.get("RESULT_CACHE_URL")))
+        sessions = SessionStore(
+            backend_from_url(os.environ.get("SESSION_STORE_URL"), namespace="chat-session:")
+        )
+        cassette = Cassette(CASSETTE_RECORD) if CASSETTE_RECORD else None
+
+        import columnar
+
+        use_columnar = QUERY_FETCH == "arrow" and columnar.available()
+        if QUERY_FETCH == "arrow" and not use_columnar:
+            print("QUERY_FETCH=arrow needs pyarrow, reading results row by row")
+        metadata_cache = bigquery_pool = None
+        if QUERY_BACKEND == "local":
+            with span("startup.local_tools"):
+                from local_tools import LocalTools
+
+                tools = LocalTools(columnar=use_columnar)
+        else:
+            with span("startup.bigquery"):
+                from bigquery_tools import BigQueryTools
+
+                bigquery_pool = get_bigquery_pool(GCP_PROJECT_ID)
+                metadata_cache = get_metadata_cache(bigquery_pool.create_client())
+            with span("startup.metadata"):
+                # one cache per process; from the last snapshot when there is one, and
+                # refreshed from BigQuery in the background, else warmed before the first question
+                if STARTUP_SNAPSHOT and _load_snapshot(metadata_cache, STARTUP_SNAPSHOT):
+                    threading.Thread(
+                        target=_warm_metadata, args=(metadata_cache, STARTUP_SNAPSHOT), daemon=True
+                    ).start()
+                else:
+                    _warm_metadata(metadata_cache, STARTUP_SNAPSHOT)
+                if CASSETTE_PREWARM:
+                    print("prewarmed " + str(prewarm(Cassette(CASSETTE_PREWARM), metadata_cache, result_cache)))
+            tools = BigQueryTools(
+                bigquery_pool, metadata_cache, result_cache,
+                cost_guard=CostGuard(metadata_cache), columnar=use_columnar,
+            )
+        if cassette is not None:
+            tools = RecordingTools(tools, cassette)
+        rollups = _start_rollups(tools) if ROLLUP_REFRESH else None
+
+        engine = ChatEngine(
+            model, tools, result_cache, sessions,
+            cassette=cassette, metadata_cache=metadata_cache, bigquery_pool=bigquery_pool,
+            rollups=rollups, query_log=QueryLog(QUERY_LOG),
+        )
+        if CACHE_WARM_AT:
+            engine.warmer = CacheWarmer(engine, engine.query_log, warm_at=parse_times(CACHE_WARM_AT)).start()
+        with span("startup.warm_up"):
+            try:
+                engine.warm_up()
+            except Exception as e:
+                print("engine warm-up failed: " + str(e))
+    engine.startup = {
+        "seconds": startup.duration_ms / 1000,
+        "timeline": waterfall(tracer.trace(startup.trace_id)),
+    }
+    print(f"engine ready in {startup.duration_ms:.0f} ms")
+    return engine
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the engine shared by every request in this process."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = build_engine()
+        return _engine
+
+
+def start_engine():
+    """Build the engine in a background thread; ``get_engine`` waits for it."""
+    threading.Thread(target=get_engine, name="engine-startup", daemon=True).start()
+
+
+def engine_ready():
+    return _engine is not None
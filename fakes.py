@@ -0,0 +1,71 @@
+"""Offline stand-ins for Gemini and BigQuery.
+
+Used to drive ``orchestrator.Orchestrator`` without network access, e.g.
+
+    chat = FakeChat([
+        LlmReply(calls=[("sql_query", {"query": "SELECT 1"})]),
+        LlmReply(text="There is 1 row."),
+    ])
+    tools = FakeTools(queries={"SELECT 1": "[{'f0_': 1}]"})
+    asyncio.run(Orchestrator(tools).run(chat, "how many?"))
+"""
+import asyncio
+
+from orchestrator import LlmReply
+
+
+class FakeChat:
+    """Replays scripted replies; records what it was sent."""
+
+    def __init__(self, replies, latency=0.0):
+        self.replies = list(replies)
+        self.latency = latency
+        self.sent = []
+
+    async def send(self, content, on_text=None):
+        self.sent.append(content)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if not self.replies:
+            return LlmReply(text="")
+        reply = self.replies.pop(0)
+        if reply.text and on_text is not None:
+            on_text(reply.text)
+        return reply
+
+
+class FakeTools:
+    """In-memory datasets, tables and canned query results."""
+
+    def __init__(self, tables=None, queries=None, latency=0.0):
+        # tables: {"UDMH.patient_dim": [{"name": "patient_id", "type": "STRING"}, ...]}
+        self.tables = tables or {}
+        self.queries = queries or {}
+        self.latency = latency
+        self.calls = []
+
+    async def _record(self, *call):
+        self.calls.append(call)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def list_datasets(self):
+        await self._record("list_datasets")
+        return sorted({table_id.split(".")[0] for table_id in self.tables})
+
+    async def list_tables(self, dataset_id):
+        await self._record("list_tables", dataset_id)
+        return [t.split(".")[1] for t in self.tables if t.split(".")[0] == dataset_id]
+
+    async def get_table(self, table_id):
+        await self._record("get_table", table_id)
+        table_id = ".".join(table_id.strip("`").split(".")[-2:])
+        if table_id not in self.tables:
+            raise KeyError(f"Not found: Table {table_id}")
+        return {"id": table_id, "schema": {"fields": self.tables[table_id]}}
+
+    async def query(self, sql):
+        await self._record("query", sql)
+        if sql not in self.queries:
+            raise ValueError(f"no canned result for {sql}")
+        return self.queries[sql]
@@ -0,0 +1,142 @@
+"""Bounded chat history per Streamlit session.
+
+``st.session_state.messages`` used to grow forever and every entry carried
+its full ``backend_details`` (raw API responses, whole result dumps).
+``SessionHistory`` keeps the last ``max_messages`` messages; older ones are
+compacted into one short line per question. Tool payloads over
+``spill_threshold`` characters go to a process-wide ``SpillStore`` and the
+message keeps only their id.
+
+``SessionHistory.visible`` returns only the tail the page shows, so a rerun
+re-renders a dozen messages instead of the whole session.
+"""
+import collections
+import hashlib
+import os
+import threading
+
+DEFAULT_MAX_MESSAGES = 40
+DEFAULT_VISIBLE_MESSAGES = 12
+DEFAULT_SPILL_THRESHOLD = 2000
+DEFAULT_SPILL_ENTRIES = 500
+MAX_COMPACTED = 50
+
+
+class SpillStore:
+    """Large payloads by id, in memory or as files under ``directory``; LRU either way.
+
+    In directory mode ``_entries`` maps each id to its size and the files are
+    the payloads; files left by an earlier process are indexed oldest first.
+    """
+
+    def __init__(self, directory=None, max_entries=DEFAULT_SPILL_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            with os.scandir(directory) as found:
+                files = [f for f in found if f.name.endswith(".md")]
+            for f in sorted(files, key=lambda f: f.stat().st_mtime):
+                self._entries[f.name[:-3]] = f.stat().st_size
+            self._evict()
+
+    def _path(self, spill_id):
+        return os.path.join(self.directory, spill_id + ".md")
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            spill_id, _ = self._entries.popitem(last=False)
+            if self.directory:
+                try:
+                    os.remove(self._path(spill_id))
+                except FileNotFoundError:
+                    pass
+
+    def put(self, text):
+        spill_id = hashlib.sha256(text.encode("utf-8")).hexdigest()[:24]
+        with self._lock:
+            if self.directory:
+                try:
+                    os.utime(self._path(spill_id))  # recency survives a restart
+                except FileNotFoundError:
+                    with open(self._path(spill_id), "w", encoding="utf-8") as f:
+                        f.write(text)
+                self._entries[spill_id] = len(text)
+            else:
+                self._entries[spill_id] = text
+            self._entries.move_to_end(spill_id)
+            self._evict()
+        return spill_id
+
+    def get(self, spill_id):
+        """Return the payload, or None once it has been evicted."""
+        if self.directory:
+            try:
+                with open(self._path(spill_id), encoding="utf-8") as f:
+                    return f.read()
+            except FileNotFoundError:
+                return None
+        with self._lock:
+            return self._entries.get(spill_id)
+
+    def stats(self):
+        with self._lock:
+            sizes = [v if isinstance(v, int) else len(v) for v in self._entries.values()]
+            return {"entries": len(sizes), "chars": sum(sizes)}
+
+
+class SessionHistory:
+    def __init__(
+        self,
+        spill_store,
+        max_messages=DEFAULT_MAX_MESSAGES,
+        spill_threshold=DEFAULT_SPILL_THRESHOLD,
+    ):
+        self.spill_store = spill_store
+        self.spill_threshold = spill_threshold
+        self.messages = collections.deque(maxlen=max_messages)
+        self.compacted = collections.deque(maxlen=MAX_COMPACTED)
+        self.dropped = 0
+
+    def append(self, role, content, backend_details=None):
+        if len(self.messages) == self.messages.maxlen:
+            self._compact(self.messages[0])
+        message = {"role": role, "content": content}
+        if backend_details:
+            if len(backend_details) > self.spill_threshold:
+                message["backend_details_ref"] = self.spill_store.put(backend_details)
+            else:
+                message["backend_details"] = backend_details
+        self.messages.append(message)
+        return message
+
+    def _compact(self, message):
+        self.dropped += 1
+        if message["role"] == "user":
+            question = " ".join(message["content"].split())
+            self.compacted.append(question[:120] + ("…" if len(question) > 120 else ""))
+
+    def backend_details(self, message):
+        if "backend_details_ref" in message:
+            details = self.spill_store.get(message["backend_details_ref"])
+            return details if details is not None else "(details expired)"
+        return message.get("backend_details", "")
+
+    def visible(self, count=DEFAULT_VISIBLE_MESSAGES):
+        """The last ``count`` messages, and how many retained ones are hidden before them."""
+        messages = list(self.messages)
+        shown = messages[-count:] if count else messages
+        return shown, len(messages) - len(shown)
+
+    def recent(self, count):
+        """The last ``count`` messages, oldest first."""
+        return list(self.messages)[-count:]
+
+    def stats(self):
+        return {
+            "messages": len(self.messages),
+            "dropped": self.dropped,
+            "chars": sum(len(m["content"]) + len(m.get("backend_details", "")) for m in self.messages),
+        }
@@ -0,0 +1,265 @@
+"""Fast path for recognized question patterns, answered without the model.
+
+Most questions are one of a handful of intents with parameters: how many
+orders of a type in the last N days/weeks/months, the average length of
+stay (overall, for a department or per department) and the top K patients
+by stay. ``match`` recognizes those, fills a fixed SQL template with
+validated parameters and ``TemplateMatcher.run`` answers with a single
+query and a templated answer. A question with any word the intent does not
+account for is not matched and goes through the full model loop.
+"""
+import csv
+import dataclasses
+import io
+import re
+
+from orchestrator import ToolCall, TurnResult, _call
+
+DEFAULT_DATASET_ID = "UDMH"
+MAX_TOP_K = 50
+
+ORDER_TYPES = {
+    "lab": "Lab", "labs": "Lab", "laboratory": "Lab",
+    "imaging": "Imaging", "radiology": "Imaging", "scan": "Imaging", "scans": "Imaging",
+    "surgery": "Surgery", "surgeries": "Surgery", "surgical": "Surgery",
+    "medication": "Medication", "medications": "Medication", "medicine": "Medication",
+    "prescription": "Medication", "prescriptions": "Medication",
+}
+DEPARTMENTS = {
+    "radiology": "Radiology", "laboratory": "Laboratory", "lab": "Laboratory", "pharmacy": "Pharmacy",
+    "outpatient": "Outpatient", "inpatient": "Inpatient", "icu": "ICU", "emergency": "Emergency",
+    "er": "Emergency", "ed": "Emergency",
+}
+_NUMBERS = {
+    "a": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "twelve": 12, "fifteen": 15, "twenty": 20, "thirty": 30,
+}
+_UNITS = {
+    "day": ("DAY", 1), "week": ("DAY", 7), "fortnight": ("DAY", 14), "month": ("MONTH", 1), "year": ("YEAR", 1),
+}
+
+# words any question may contain without changing what is asked
+_FILLER = {
+    "what", "whats", "is", "are", "was", "were", "the", "a", "an", "of", "for", "in", "on", "during",
+    "me", "get", "give", "show", "tell", "please", "can", "you", "could", "i", "we", "do", "did",
+    "have", "has", "had", "there", "been", "find", "list", "to", "s", "about", "total", "our",
+    "which", "who", "whom",
+}
+_ORDER_WORDS = {"how", "many", "count", "number", "orders", "order", "placed", "last", "past", "previous"}
+_STAY_WORDS = {"average", "avg", "mean", "length", "stay", "stays", "los", "days", "hospital", "patient", "patients"}
+_TOP_WORDS = {
+    "top", "patients", "patient", "by", "with", "longest", "stay", "stays", "length", "most", "days", "hospital",
+}
+
+
+@dataclasses.dataclass
+class TemplateMatch:
+    intent: str
+    params: dict
+    sql: str
+
+
+def _words(question):
+    return re.findall(r"[a-z0-9]+", question.lower().replace("'", ""))
+
+
+def _number(word):
+    if word.isdigit():
+        return int(word)
+    return _NUMBERS.get(word)
+
+
+def _window(words):
+    """Find "last/past N <unit>s", returning (params, the words it used)."""
+    for i, word in enumerate(words):
+        if word not in ("last", "past", "previous"):
+            continue
+        count, j = 1, i + 1
+        if j < len(words) and _number(words[j]) is not None:
+            count, j = _number(words[j]), j + 1
+        unit = words[j].rstrip("s") if j < len(words) else None
+        if unit in _UNITS:
+            part, days = _UNITS[unit]
+            label = unit if count == 1 else f"{count} {unit}s"
+            return {"interval": count * days, "part": part, "label": label}, set(words[i:j + 1])
+    return None, set()
+
+
+def _unexplained(words, allowed):
+    return [w for w in words if w not in allowed and w not in _FILLER]
+
+
+def _order_count(words, ds):
+    if "orders" not in words and "order" not in words:
+        return None
+    types = {ORDER_TYPES[w] for w in words if w in ORDER_TYPES}
+    window, used = _window(words)
+    if len(types) != 1 or window is None:
+        return None
+    if _unexplained(words, _ORDER_WORDS | set(ORDER_TYPES) | used):
+        return None
+    order_type = types.pop()
+    sql = (
+        f"SELECT COUNT(*) AS order_count FROM {ds}.clncl_ordr_dim "
+        f"WHERE order_type = '{order_type}' "
+        f"AND order_date >= DATE_SUB(CURRENT_DATE(), INTERVAL {window['interval']} {window['part']})"
+    )
+    return TemplateMatch("order_count", {"order_type": order_type, **window}, sql)
+
+
+def _average_stay(words, ds):
+    if "stay" not in words and "los" not in words:
+        return None
+    if not {"average", "avg", "mean"} & set(words):
+        return None
+    departments = {DEPARTMENTS[w] for w in words if w in DEPARTMENTS}
+    per_department = bool({"by", "per", "each"} & set(words)) and bool({"department", "departments"} & set(words))
+    allowed = _STAY_WORDS | set(DEPARTMENTS) | {"by", "per", "each", "department", "departments", "across", "all"}
+    if _unexplained(words, allowed) or len(departments) > 1 or (per_department and departments):
+        return None
+    los = "DATE_DIFF(discharge_date, admission_date, DAY)"
+    if per_department:
+        sql = (
+            f"SELECT department_name, ROUND(AVG({los}), 2) AS avg_los_days, COUNT(*) AS encounters "
+            f"FROM {ds}.encounter_dim GROUP BY department_name ORDER BY avg_los_days DESC"
+        )
+        return TemplateMatch("average_stay", {"per_department": True}, sql)
+    department = departments.pop() if departments else None
+    where = f" WHERE department_name = '{department}'" if department else ""
+    sql = f"SELECT ROUND(AVG({los}), 2) AS avg_los_days, COUNT(*) AS encounters FROM {ds}.encounter_dim{where}"
+    return TemplateMatch("average_stay", {"department": department}, sql)
+
+
+def _top_patients(words, ds):
+    if "patients" not in words and "patient" not in words:
+        return None
+    if "stay" not in words and "stays" not in words:
+        return None
+    if not {"top", "longest", "most"} & set(words):
+        return None
+    numbers = [_number(w) for w in words if w.isdigit() or (w in _NUMBERS and w != "a")]
+    if len(numbers) > 1:
+        return None
+    k = numbers[0] if numbers else 5
+    used = {w for w in words if w.isdigit() or w in _NUMBERS}
+    if not 1 <= k <= MAX_TOP_K or _unexplained(words, _TOP_WORDS | used):
+        return None
+    sql = (
+        f"SELECT e.patient_id, p.first_name, p.last_name, COUNT(*) AS encounters, "
+        f"SUM(DATE_DIFF(e.discharge_date, e.admission_date, DAY)) AS total_los_days, "
+        f"MAX(DATE_DIFF(e.discharge_date, e.admission_date, DAY)) AS longest_los_days "
+        f"FROM {ds}.encounter_dim e JOIN {ds}.patient_dim p ON e.patient_id = p.patient_id "
+        f"GROUP BY e.patient_id, p.first_name, p.last_name "
+        f"ORDER BY total_los_days DESC, longest_los_days DESC, e.patient_id LIMIT {k}"
+    )
+    return TemplateMatch("top_patients_by_stay", {"k": k}, sql)
+
+
+_MATCHERS = (_order_count, _average_stay, _top_patients)
+
+
+def match(question, dataset_id=DEFAULT_DATASET_ID):
+    """Return the ``TemplateMatch`` for ``question``, or None to use the model."""
+    words = _words(question)
+    for matcher in _MATCHERS:
+        found = matcher(words, dataset_id)
+        if found is not None:
+            return found
+    return None
+
+
+def _rows(text):
+    """Rows of a ``serialize_rows`` result, without the truncation and summary lines."""
+    lines = []
+    for line in str(text).splitlines():
+        if not line or line.startswith("[truncated") or line.startswith("summary"):
+            break
+        lines.append(line)
+    return list(csv.DictReader(io.StringIO("\n".join(lines))))
+
+
+def _render_order_count(rows, params, sql):
+    count = rows[0]["order_count"] if rows else "0"
+    return (
+        f"There were **{count or 0} {params['order_type']} orders** in the last {params['label']}.\n\n"
+        f"Source: the clinical orders table (`clncl_ordr_dim`), counting rows with "
+        f"order_type '{params['order_type']}' and an order_date in that window."
+    )
+
+
+def _render_average_stay(rows, params, sql):
+    source = (
+        "Source: the encounters table (`encounter_dim`), length of stay is the number of days "
+        "between admission_date and discharge_date."
+    )
+    if params.get("per_department"):
+        lines = [
+            f"- {r['department_name']}: {r['avg_los_days']} days ({r['encounters']} encounters)"
+            for r in rows
+        ]
+        return "Average length of stay by department:\n\n" + "\n".join(lines) + "\n\n" + source
+    row = rows[0] if rows else {"avg_los_days": "", "encounters": "0"}
+    where = f" in {params['department']}" if params.get("department") else ""
+    if not row["avg_los_days"]:
+        return f"There are no encounters{where} to average.\n\n" + source
+    return (
+        f"The average length of stay{where} is **{row['avg_los_days']} days** "
+        f"across {row['encounters']} encounters.\n\n" + source
+    )
+
+
+def _render_top_patients(rows, params, sql):
+    lines = [
+        f"{i}. {r['first_name']} {r['last_name']} ({r['patient_id']}): {r['total_los_days']} days "
+        f"over {r['encounters']} encounters, longest stay {r['longest_los_days']} days"
+        for i, r in enumerate(rows, 1)
+    ]
+    return (
+        f"Top {params['k']} patients by total length of stay:\n\n" + "\n".join(lines) + "\n\n"
+        "Source: the encounters table (`encounter_dim`) joined to the patients table (`patient_dim`) "
+        "on patient_id; stay days are the days between admission_date and discharge_date."
+    )
+
+
+_RENDERERS = {
+    "order_count": _render_order_count,
+    "average_stay": _render_average_stay,
+    "top_patients_by_stay": _render_top_patients,
+}
+
+
+class TemplateMatcher:
+    """Answers matched questions with one query through ``tools.query``.
+
+    ``router`` is the same optional hook as the orchestrator's, so templates
+    benefit from the rollups too.
+    """
+
+    def __init__(self, tools, dataset_id=DEFAULT_DATASET_ID, router=None):
+        self.tools = tools
+        self.dataset_id = dataset_id
+        self.router = router
+        self.matched = 0
+        self.fallbacks = 0
+
+    def match(self, question):
+        return match(question, self.dataset_id)
+
+    async def run(self, template):
+        """Answer ``template``; returns a ``TurnResult``, or None to fall back to the model."""
+        sql = template.sql
+        if self.router is not None:
+            sql = self.router(sql) or sql
+        call = ToolCall("sql_query", {"query": sql}, sql=sql)
+        try:
+            call.response = await _call(self.tools.query, sql)
+            answer = _RENDERERS[template.intent](_rows(call.response), template.params, sql)
+        except Exception as e:
+            print("template " + template.intent + " failed: " + str(e))
+            self.fallbacks += 1
+            return None
+        self.matched += 1
+        return TurnResult(answer=answer, calls=[call], last_sql=sql)
+
+    def stats(self):
+        return {"matched": self.matched, "fallbacks": self.fallbacks}
@@ -0,0 +1,269 @@
+"""Local stand-in for BigQuery over the CSVs in UDMH_dummyData.zip.
+
+The tables are loaded into an in-process DuckDB database with typed date
+columns, and the BigQuery SQL the model writes is translated to DuckDB
+before it runs. ``LocalTools`` has the same methods as
+``bigquery_tools.BigQueryTools``, so the orchestrator runs unchanged against
+either one, without network access.
+"""
+import collections
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import zipfile
+
+import duckdb
+
+from cancellation import attached
+from columnar import read_batches, serialize_table
+from result_cache import normalize_sql
+from serialization import PAGE_SIZE, SCAN_ROWS, serialize_rows
+from singleflight import SingleFlight
+from tracing import span
+
+DEFAULT_ZIP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "UDMH_dummyData.zip")
+DEFAULT_DATASET_ID = "UDMH"
+DATE_COLUMNS = {"dob", "order_date", "admission_date", "discharge_date"}
+RESULTS_SCHEMA = "session_results"
+KEPT_RESULTS = 50
+_RESULT_REF = re.compile(r"\b" + RESULTS_SCHEMA + r"\.(r_[0-9a-f]{16})\b")
+
+_BIGQUERY_TYPES = {
+    "VARCHAR": "STRING",
+    "DATE": "DATE",
+    "TIMESTAMP": "TIMESTAMP",
+    "BIGINT": "INTEGER",
+    "INTEGER": "INTEGER",
+    "DOUBLE": "FLOAT",
+    "BOOLEAN": "BOOLEAN",
+}
+
+
+def _split_args(text):
+    """Split a function argument list on top-level commas."""
+    args, depth, current, quote = [], 0, "", None
+    for ch in text:
+        if quote:
+            current += ch
+            if ch == quote:
+                quote = None
+            continue
+        if ch in "'\"":
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            args.append(current.strip())
+            current = ""
+            continue
+        current += ch
+    args.append(current.strip())
+    return args
+
+
+def _rewrite_calls(sql, name, rewrite):
+    """Replace every ``name(...)`` call with ``rewrite(args)``."""
+    pattern = re.compile(r"\b" + name + r"\s*\(", re.IGNORECASE)
+    out, pos = "", 0
+    while True:
+        match = pattern.search(sql, pos)
+        if match is None:
+            return out + sql[pos:]
+        depth, end = 1, match.end()
+        while end < len(sql) and depth:
+            if sql[end] == "(":
+                depth += 1
+            elif sql[end] == ")":
+                depth -= 1
+            end += 1
+        args = [_rewrite_calls(arg, name, rewrite) for arg in _split_args(sql[match.end():end - 1])]
+        out += sql[pos:match.start()] + rewrite(args)
+        pos = end
+
+
+def _interval(args, sign):
+    return f"({args[0]} {sign} {args[1]})"
+
+
+def translate_sql(sql, dataset_id=DEFAULT_DATASET_ID):
+    """Translate the BigQuery dialect the model emits into DuckDB SQL."""
+    # `project.UDMH.table` / `UDMH.table` -> UDMH.table
+    sql = re.sub(r"`(?:[\w-]+\.)?(\w+)\.(\w+)`", r"\1.\2", sql)
+    sql = re.sub(r"\b[\w-]+\.(" + dataset_id + r")\.(\w+)", r"\1.\2", sql)
+    sql = sql.replace("`", '"')
+    sql = re.sub(r"\b(CURRENT_DATE|CURRENT_TIMESTAMP|CURRENT_DATETIME)\s*\(\s*\)", r"\1", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bCURRENT_DATETIME\b", "CURRENT_TIMESTAMP", sql, flags=re.IGNORECASE)
+    for func in ("DATE_SUB", "DATETIME_SUB", "TIMESTAMP_SUB"):
+        sql = _rewrite_calls(sql, func, lambda a: _interval(a, "-"))
+    for func in ("DATE_ADD", "DATETIME_ADD", "TIMESTAMP_ADD"):
+        sql = _rewrite_calls(sql, func, lambda a: _interval(a, "+"))
+    for func in ("DATE_DIFF", "DATETIME_DIFF", "TIMESTAMP_DIFF"):
+        sql = _rewrite_calls(sql, func, lambda a: f"date_diff('{a[2].lower()}', {a[1]}, {a[0]})")
+    sql = _rewrite_calls(
+        sql, "DATE_TRUNC",
+        lambda a: f"CAST(date_trunc('{a[1].lower()}', {a[0]}) AS DATE)",
+    )
+    sql = _rewrite_calls(sql, "SAFE_DIVIDE", lambda a: f"({a[0]} / NULLIF({a[1]}, 0))")
+    sql = re.sub(r"\bSAFE_CAST\s*\(", "TRY_CAST(", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bFLOAT64\b", "DOUBLE", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bINT64\b", "BIGINT", sql, flags=re.IGNORECASE)
+    return sql
+
+
+def _fetch_pages(cursor):
+    """The first ``SCAN_ROWS`` rows, and whether the result has more."""
+    rows = []
+    while len(rows) < SCAN_ROWS:
+        page = cursor.fetchmany(min(PAGE_SIZE, SCAN_ROWS - len(rows)))
+        if not page:
+            return rows, False
+        rows.extend(page)
+    return rows, cursor.fetchone() is not None
+
+
+def record_batches(cursor, batch_size=PAGE_SIZE):
+    """Arrow record batches of the cursor's result (``fetch_record_batch`` before DuckDB 1.4)."""
+    reader = getattr(cursor, "to_arrow_reader", None) or cursor.fetch_record_batch
+    return reader(batch_size)
+
+
+class LocalTools:
+    def __init__(self, zip_path=DEFAULT_ZIP_PATH, dataset_id=DEFAULT_DATASET_ID, columnar=False):
+        self.dataset_id = dataset_id
+        self.columnar = columnar
+        self.flights = SingleFlight()
+        self._connection = duckdb.connect()
+        self._local = threading.local()
+        self._results = collections.OrderedDict()
+        self._results_lock = threading.Lock()
+        self._connection.execute(f"CREATE SCHEMA {dataset_id}")
+        self._connection.execute(f"CREATE SCHEMA {RESULTS_SCHEMA}")
+        with tempfile.TemporaryDirectory() as tmp, zipfile.ZipFile(zip_path) as archive:
+            for name in archive.namelist():
+                if not name.endswith(".csv"):
+                    continue
+                path = archive.extract(name, tmp)
+                self.load_csv(os.path.splitext(os.path.basename(name))[0], path)
+
+    def load_csv(self, table_name, path):
+        columns = self._connection.execute(
+            "SELECT * FROM read_csv_auto(?, all_varchar=true) LIMIT 0", [path]
+        ).description
+        types = {col[0]: "DATE" if col[0] in DATE_COLUMNS else "VARCHAR" for col in columns}
+        self._connection.execute(
+            f"CREATE OR REPLACE TABLE {self.dataset_id}.{table_name} AS "
+            f"SELECT * FROM read_csv(?, header=true, columns={types!r})",
+            [path],
+        )
+
+    def _cursor(self):
+        # DuckDB connections are not shared across threads, cursors are
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = self._local.cursor = self._connection.cursor()
+        return cursor
+
+    def list_datasets(self):
+        return [self.dataset_id]
+
+    def list_tables(self, dataset_id):
+        rows = self._cursor().execute(
+            "SELECT table_name FROM information_schema.tables WHERE table_schema = ? ORDER BY 1",
+            [dataset_id],
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_table(self, table_id):
+        """Return a dict shaped like ``Table.to_api_repr()``."""
+        dataset_id, table_name = table_id.strip("`").split(".")[-2:]
+        cursor = self._cursor()
+        columns = cursor.execute(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema = ? AND table_name = ? ORDER BY ordinal_position",
+            [dataset_id, table_name],
+        ).fetchall()
+        if not columns:
+            raise ValueError(f"Not found: Table {dataset_id}.{table_name}")
+        num_rows = cursor.execute(f"SELECT COUNT(*) FROM {dataset_id}.{table_name}").fetchone()[0]
+        return {
+            "tableReference": {"datasetId": dataset_id, "tableId": table_name},
+            "schema": {
+                "fields": [
+                    {"name": name, "type": _BIGQUERY_TYPES.get(type_, "STRING"), "mode": "NULLABLE"}
+                    for name, type_ in columns
+                ]
+            },
+            "numRows": str(num_rows),
+        }
+
+    def execute(self, sql):
+        return self._cursor().execute(self._with_results(sql)).fetchall()
+
+    def data_version(self, dataset_id):
+        # loaded once from the zip at startup
+        return 0
+
+    def result_handle(self, sql):
+        """Name a table for the result of ``sql``, for follow-up queries.
+
+        Nothing runs here: most turns get no follow-up, so the table is only
+        built when a query first reads it (``_with_results``).
+        """
+        name = "r_" + hashlib.sha256(normalize_sql(sql).encode("utf-8")).hexdigest()[:16]
+        with self._results_lock:
+            if name in self._results:
+                self._results.move_to_end(name)
+            else:
+                self._results[name] = {"sql": sql, "built": False}
+                while len(self._results) > KEPT_RESULTS:
+                    dropped, entry = self._results.popitem(last=False)
+                    if entry["built"]:
+                        self._cursor().execute(f"DROP TABLE IF EXISTS {RESULTS_SCHEMA}.{dropped}")
+        return f"{RESULTS_SCHEMA}.{name}"
+
+    def _with_results(self, sql):
+        """Translate ``sql``, first building the result tables it reads that do not exist yet."""
+        translated = translate_sql(sql, self.dataset_id)
+        for name in set(_RESULT_REF.findall(translated)):
+            with self._results_lock:
+                entry = self._results.get(name)
+                if entry is None or entry["built"]:
+                    continue
+                source = translate_sql(entry["sql"].strip().rstrip(";"), self.dataset_id)
+                self._cursor().execute(f"CREATE OR REPLACE TABLE {RESULTS_SCHEMA}.{name} AS {source}")
+                entry["built"] = True
+        return translated
+
+    def cursor(self, sql):
+        """Run ``sql`` and return the cursor, for callers that fetch the result themselves."""
+        return self._cursor().execute(self._with_results(sql))
+
+    def query(self, sql):
+        key = ("query", normalize_sql(sql))
+        # a caller that times out interrupts the statement; later callers must not join it
+        with attached(lambda: self.flights.forget(key)):
+            return self.flights.do(key, self._query, sql)
+
+    def _query(self, sql):
+        cursor = self._cursor()
+        # interrupting raises in execute or fetch and frees this worker thread
+        with attached(cursor.interrupt):
+            with span("local.query"):
+                translated = self._with_results(sql)
+                cursor.execute(translated)
+            names = [col[0] for col in cursor.description]
+            if self.columnar:
+                table = read_batches(record_batches(cursor), names=names)
+                total_rows = self._count(translated) if table.num_rows >= SCAN_ROWS else None
+                return serialize_table(table, total_rows=total_rows)
+            rows, more = _fetch_pages(cursor)
+            return serialize_rows(names, rows, total_rows=self._count(translated) if more else None)
+
+    def _count(self, translated):
+        # BigQuery reports the total of a result it stopped reading; DuckDB has to count it
+        with span("local.count"):
+            return self._cursor().execute(f"SELECT COUNT(*) FROM ({translated}) AS counted").fetchone()[0]
@@ -0,0 +1,133 @@
+"""Process-wide cache for BigQuery dataset and table metadata.
+
+The UDMH schema almost never changes, so the answers to list_datasets,
+list_tables and get_table are kept in memory with a TTL instead of asking
+BigQuery on every chat turn.
+"""
+import threading
+import time
+
+from singleflight import SingleFlight
+
+DEFAULT_TTL_SECONDS = 15 * 60
+
+
+def normalize_table_id(table_id):
+    # the model sends "UDMH.patient_dim", "`asc-colabathon.UDMH.patient_dim`", ...
+    parts = str(table_id).strip().strip("`").split(".")
+    return ".".join(parts[-2:])
+
+
+class MetadataCache:
+    def __init__(self, client, ttl_seconds=DEFAULT_TTL_SECONDS, clock=time.monotonic):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.flights = SingleFlight()
+
+    def _lookup(self, key, loader):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self._clock():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # sessions missing the same entry at once share one BigQuery call
+        return self.flights.do(key, self._load, key, loader)
+
+    def _load(self, key, loader):
+        value = loader()
+        self._store(key, value)
+        return value
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl_seconds, value)
+
+    def list_datasets(self):
+        return self._lookup(
+            ("datasets",),
+            lambda: [str(dataset.dataset_id) for dataset in self.client.list_datasets()],
+        )
+
+    def list_tables(self, dataset_id):
+        return self._lookup(
+            ("tables", dataset_id),
+            lambda: [table.table_id for table in self.client.list_tables(dataset_id)],
+        )
+
+    def get_table(self, table_id):
+        """Return the table resource as ``Table.to_api_repr()`` would."""
+        table_id = normalize_table_id(table_id)
+        return self._lookup(
+            ("table", table_id),
+            lambda: self.client.get_table(table_id).to_api_repr(),
+        )
+
+    def prime(self, method, *args, value):
+        """Store a known answer for ``method(*args)``, e.g. from a recorded trace."""
+        if method == "list_datasets":
+            self._store(("datasets",), value)
+        elif method == "list_tables":
+            self._store(("tables", args[0]), value)
+        elif method == "get_table":
+            self._store(("table", normalize_table_id(args[0])), value)
+        else:
+            raise ValueError(f"unknown metadata call {method}")
+
+    def invalidate(self, table_id=None):
+        """Drop one table (and its dataset listing) or, with no argument, everything."""
+        with self._lock:
+            if table_id is None:
+                self._entries.clear()
+                return
+            table_id = normalize_table_id(table_id)
+            self._entries.pop(("table", table_id), None)
+            self._entries.pop(("tables", table_id.split(".")[0]), None)
+
+    def warm(self, dataset_ids=None):
+        """Load datasets, tables and table resources up front.
+
+        Warming goes straight to BigQuery so it neither counts as a miss nor
+        serves stale entries.
+        """
+        datasets = [str(dataset.dataset_id) for dataset in self.client.list_datasets()]
+        self._store(("datasets",), datasets)
+        for dataset_id in dataset_ids or datasets:
+            tables = list(self.client.list_tables(dataset_id))
+            self._store(("tables", dataset_id), [table.table_id for table in tables])
+            for table in tables:
+                table_id = f"{dataset_id}.{table.table_id}"
+                self._store(("table", table_id), self.client.get_table(table_id).to_api_repr())
+
+    def snapshot(self):
+        """Live entries as JSON-ready ``[key, value]`` pairs, for ``restore`` in a new process."""
+        now = self._clock()
+        with self._lock:
+            return [[list(key), value] for key, (expires, value) in self._entries.items() if expires > now]
+
+    def restore(self, entries):
+        for key, value in entries:
+            self._store(tuple(key), value)
+        return len(entries)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_metadata_cache(client, ttl_seconds=DEFAULT_TTL_SECONDS):
+    """Return the cache shared by every session in this process."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MetadataCache(client, ttl_seconds=ttl_seconds)
+        return _cache
@@ -0,0 +1,222 @@
+"""Async function-calling loop between Gemini and the data tools.
+
+The loop that used to live inside the Streamlit script: send the prompt,
+run whatever function calls the model asks for, send the results back and
+repeat until the model answers in text. Independent work runs concurrently:
+every function call part in a reply, and every dataset of a list_tables
+call. Each tool call has its own timeout.
+
+Both sides are plain objects so the loop runs offline against the fakes in
+``fakes.py``:
+
+- the chat has ``send(content, on_text=None)`` returning an ``LlmReply``;
+  ``content`` is the prompt string or a list of ``(name, response)``
+  function results.
+- the tools object has ``list_datasets()``, ``list_tables(dataset_id)``,
+  ``get_table(table_id)`` and ``query(sql)``; they may be sync or async.
+
+An optional ``router(sql)`` returns a cheaper equivalent query (see
+``rollups.route``) or None to run the model's SQL as written. An optional
+``policy`` (``policy.ExecutionPolicy``) retries transient errors, turns
+failed calls into hints for the model and caps round trips and time.
+
+A call that times out, or a turn that is cancelled, also cancels the work
+behind it (``cancellation``): the BigQuery job or DuckDB statement stops and
+gives back its pool client, and a Gemini stream stops reading.
+"""
+import asyncio
+import dataclasses
+import inspect
+import time
+
+from cancellation import CancelScope
+from compaction import SchemaLedger, compact_table
+from policy import BUDGET_EXHAUSTED, classify
+from tracing import current_span, span
+
+DEFAULT_CALL_TIMEOUT_SECONDS = 60
+CANNOT_FULFILL = "Cannot fulfill this request at this moment. Try a differnt prompt"
+
+
+@dataclasses.dataclass
+class LlmReply:
+    calls: list = dataclasses.field(default_factory=list)  # [(name, args), ...]
+    text: str = ""
+    first_token_at: float = None
+    usage: dict = None  # {"prompt", "cached", "output"} token counts, when the chat reports them
+
+
+@dataclasses.dataclass
+class ToolCall:
+    name: str
+    params: dict
+    response: object = None
+    error: bool = False
+    seconds: float = 0.0
+    sql: str = None  # what sql_query actually ran, after cleaning and routing
+    error_kind: str = None
+
+
+@dataclasses.dataclass
+class TurnResult:
+    answer: str = ""
+    round_trips: int = 0
+    calls: list = dataclasses.field(default_factory=list)
+    last_sql: str = None
+    first_token_at: float = None
+    failed: bool = False
+    tokens: dict = dataclasses.field(default_factory=dict)
+
+
+def clean_query(query):
+    return query.replace("\\n", " ").replace("\n", "").replace("\\", "")
+
+
+async def _call(func, *args):
+    if inspect.iscoroutinefunction(func):
+        return await func(*args)
+    return await asyncio.to_thread(func, *args)
+
+
+class Orchestrator:
+    def __init__(self, tools, call_timeout=DEFAULT_CALL_TIMEOUT_SECONDS, router=None, policy=None):
+        self.tools = tools
+        self.call_timeout = call_timeout
+        self.router = router
+        self.policy = policy
+
+    async def run(self, chat, prompt, on_text=None, known_tables=()):
+        """Answer ``prompt`` on ``chat``; ``on_text`` runs on the event loop thread.
+
+        ``known_tables`` are already described in the prompt, so ``get_table``
+        for them answers with a short reference instead of the schema again.
+        """
+        result = TurnResult()
+        ledger = SchemaLedger(known_tables)
+        loop = asyncio.get_running_loop()
+        if on_text is not None:
+            # the chat streams from a worker thread, hop back before touching the UI
+            callback = on_text
+            on_text = lambda text: loop.call_soon_threadsafe(callback, text)  # noqa: E731
+
+        deadline = self.policy.deadline() if self.policy is not None else None
+        try:
+            reply = await self._send(chat, prompt, on_text, result, deadline)
+            while reply.calls:
+                stop = self.policy.exhausted(result.round_trips, deadline) if self.policy is not None else None
+                if stop is not None:
+                    print("orchestrator: " + stop)
+                    result.failed = True
+                    result.answer = BUDGET_EXHAUSTED
+                    return result
+                calls = [ToolCall(name, dict(args)) for name, args in reply.calls]
+                await asyncio.gather(*(self.dispatch(call, deadline, ledger) for call in calls))
+                result.calls.extend(calls)
+                for call in calls:
+                    if call.name == "sql_query" and not call.error:
+                        result.last_sql = call.sql
+                reply = await self._send(
+                    chat, [(call.name, {"content": call.response}) for call in calls], on_text, result, deadline
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("orchestrator: " + repr(e))
+            result.failed = True
+            result.answer = CANNOT_FULFILL
+            return result
+
+        result.answer = reply.text
+        result.first_token_at = reply.first_token_at
+        return result
+
+    async def _send(self, chat, content, on_text, result, deadline=None):
+        result.round_trips += 1
+        with span("gemini.send", round_trip=result.round_trips) as s, CancelScope().entered() as scope:
+            try:
+                if self.policy is not None:
+                    # a retried stream starts over and on_text gets the whole text again
+                    reply = await self.policy.retry(lambda: _call(chat.send, content, on_text), deadline)
+                else:
+                    reply = await _call(chat.send, content, on_text)
+            except asyncio.CancelledError:
+                scope.cancel()  # the turn timed out: stop reading the stream
+                raise
+            s.set(function_calls=len(reply.calls), text_chars=len(reply.text))
+            for key, count in (reply.usage or {}).items():
+                result.tokens[key] = result.tokens.get(key, 0) + count
+                s.set(**{key + "_tokens": count})
+        return reply
+
+    async def dispatch(self, call, deadline=None, ledger=None):
+        started = time.perf_counter()
+        timeout = self.call_timeout
+        if deadline is not None:
+            timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+        with span("tool." + call.name, params=str(call.params)[:500]) as s, CancelScope().entered() as scope:
+            try:
+                if self.policy is not None:
+                    call.response = await asyncio.wait_for(
+                        self.policy.retry(lambda: self._run_tool(call, ledger), deadline), timeout
+                    )
+                else:
+                    call.response = await asyncio.wait_for(self._run_tool(call, ledger), timeout)
+            except asyncio.CancelledError:
+                scope.cancel()  # the whole turn timed out
+                raise
+            except asyncio.TimeoutError:
+                # the worker thread is still running the call: stop its job too
+                scope.cancel()
+                call.error = True
+                call.error_kind = "timeout"
+                call.response = f"{call.name} timed out after {timeout:.0f} seconds"
+                if self.policy is not None:
+                    call.response = self.policy.hint(asyncio.TimeoutError(call.response))
+            except Exception as e:
+                call.error = True
+                if self.policy is not None:
+                    call.error_kind = classify(e)
+                    call.response = await asyncio.to_thread(self.policy.hint, e, call.sql)
+                else:
+                    call.response = f"{str(e)}"
+            s.set(error=call.error, error_kind=call.error_kind or "", response_chars=len(str(call.response)))
+        call.seconds = time.perf_counter() - started
+        return call
+
+    async def _run_tool(self, call, ledger=None):
+        if call.name == "list_datasets":
+            return await _call(self.tools.list_datasets)
+        if call.name == "list_tables":
+            dataset_ids = call.params["dataset_id"]
+            if isinstance(dataset_ids, str):
+                dataset_ids = [dataset_ids]
+            tables = await asyncio.gather(
+                *(_call(self.tools.list_tables, d) for d in dataset_ids)
+            )
+            return "".join(str(t) for t in tables)
+        if call.name == "get_table":
+            resource = await _call(self.tools.get_table, call.params["table_id"])
+            if ledger is None:
+                return compact_table(resource, call.params["table_id"])
+            return ledger.describe(call.params["table_id"], resource)
+        if call.name == "sql_query":
+            call.sql = clean_query(call.params["query"])
+            routed = self.router(call.sql) if self.router is not None else None
+            if routed:
+                current_span().set(routed_sql=routed)
+                call.sql = routed
+            return await _call(self.tools.query, call.sql)
+        raise ValueError(f"unknown function {call.name}")
+
+
+def format_backend_details(calls):
+    backend_details = ""
+    for call in calls:
+        backend_details += "- Function call:\n"
+        backend_details += "   - Function name: ```" + call.name + "```"
+        backend_details += "\n\n"
+        backend_details += "   - Function parameters: ```" + str(call.params) + "```"
+        backend_details += "\n\n"
+        backend_details += "   - API response: ```" + str(call.response) + "```"
+        backend_details += "\n\n"
+    return backend_details
@@ -0,0 +1,212 @@
+"""Execution policy for one question: error classes, retries, hints and budgets.
+
+A failing tool call used to send the raw exception text back to Gemini,
+and nothing bounded how many round trips a bad question could burn.
+``ExecutionPolicy``:
+
+- classifies errors as transient, timeout, bytes_limit, resources,
+  unknown_column, unknown_table, syntax or other (BigQuery and DuckDB wording)
+- retries transient errors (rate limits, quota, 5xx, dropped connections)
+  with full-jitter exponential backoff, for tool calls and Gemini calls
+- turns SQL errors into a short hint with the closest matching table or
+  column names, so the model can fix the query in one more round trip
+- caps every question at ``max_round_trips`` Gemini calls and
+  ``max_seconds`` of wall-clock time
+"""
+import asyncio
+import difflib
+import inspect
+import random
+import re
+import time
+
+from cost_guard import QueryRejected, referenced_tables
+
+DEFAULT_MAX_ROUND_TRIPS = 8
+DEFAULT_MAX_SECONDS = 45
+DEFAULT_RETRIES = 3
+DEFAULT_BASE_DELAY_SECONDS = 0.5
+DEFAULT_MAX_DELAY_SECONDS = 4.0
+MAX_HINT_CHARS = 400
+
+BUDGET_EXHAUSTED = (
+    "This question needed more steps than allowed, so it was stopped. "
+    "Try asking for something narrower, e.g. one table, one measure and a date range."
+)
+
+_TRANSIENT_TYPES = {
+    "TooManyRequests", "ServiceUnavailable", "InternalServerError", "BadGateway", "GatewayTimeout",
+    "ResourceExhausted", "Aborted", "ConnectionError", "ConnectionResetError", "RetryError",
+}
+_TRANSIENT = re.compile(
+    r"rateLimitExceeded|quota exceeded|backendError|internalError|"
+    r"\b(429|500|502|503)\b|temporarily unavailable|connection (reset|aborted)",
+    re.IGNORECASE,
+)
+_BYTES_LIMIT = re.compile(r"bytesBilledLimitExceeded|limit for bytes billed", re.IGNORECASE)
+# the same query fails the same way again: too much memory for a sort, join or aggregation
+_RESOURCES = re.compile(r"resourcesExceeded|resources exceeded|Out of Memory Error", re.IGNORECASE)
+_UNKNOWN_COLUMN = [
+    re.compile(r"Unrecognized name: (\w+)"),
+    re.compile(r'Referenced column "(\w+)" not found'),
+    re.compile(r'does not have a column named "(\w+)"'),
+    re.compile(r"Name (\w+) not found inside \w+"),
+]
+_UNKNOWN_TABLE = [
+    re.compile(r"Not found: Table [\w:-]*?\.?(\w+)\.(\w+) was not found"),
+    re.compile(r"Table with name (\w+) does not exist"),
+]
+_SYNTAX = re.compile(r"Syntax error|Parser Error", re.IGNORECASE)
+
+
+def classify(error):
+    if isinstance(error, QueryRejected) or _BYTES_LIMIT.search(str(error)):
+        return "bytes_limit"
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    message = str(error)
+    if any(pattern.search(message) for pattern in _UNKNOWN_COLUMN):
+        return "unknown_column"
+    if any(pattern.search(message) for pattern in _UNKNOWN_TABLE):
+        return "unknown_table"
+    if _SYNTAX.search(message):
+        return "syntax"
+    if _RESOURCES.search(message):
+        return "resources"
+    if (
+        type(error).__name__ in _TRANSIENT_TYPES
+        or isinstance(error, ConnectionError)
+        or _TRANSIENT.search(message)
+    ):
+        return "transient"
+    return "other"
+
+
+def _trim(message):
+    # first line only: BigQuery appends the job URL, DuckDB the SQL with a caret
+    line = str(message).strip().splitlines()[0] if str(message).strip() else ""
+    return line[:MAX_HINT_CHARS]
+
+
+def _name_similarity(name, table):
+    # "orders" should find clncl_ordr_dim: compare against each part of the name too
+    name = name.lower()
+    parts = [table.lower()] + table.lower().split("_")
+    return max(difflib.SequenceMatcher(None, name, part).ratio() for part in parts)
+
+
+class ExecutionPolicy:
+    """``tools`` is used for the schema in hints; both backends serve it from memory."""
+
+    def __init__(
+        self,
+        tools=None,
+        dataset_id="UDMH",
+        max_round_trips=DEFAULT_MAX_ROUND_TRIPS,
+        max_seconds=DEFAULT_MAX_SECONDS,
+        retries=DEFAULT_RETRIES,
+        base_delay=DEFAULT_BASE_DELAY_SECONDS,
+        max_delay=DEFAULT_MAX_DELAY_SECONDS,
+        rng=random.random,
+    ):
+        # hints read the schema synchronously; async test tools get plain messages
+        self.tools = None if inspect.iscoroutinefunction(getattr(tools, "get_table", None)) else tools
+        self.dataset_id = dataset_id
+        self.max_round_trips = max_round_trips
+        self.max_seconds = max_seconds
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._rng = rng
+
+    def delay(self, attempt):
+        """Full jitter: uniform between 0 and the capped exponential step."""
+        return self._rng() * min(self.max_delay, self.base_delay * 2 ** attempt)
+
+    async def retry(self, make_call, deadline=None):
+        """Await ``make_call()``, retrying transient errors while time allows."""
+        attempt = 0
+        while True:
+            try:
+                return await make_call()
+            except Exception as e:
+                if classify(e) != "transient" or attempt >= self.retries:
+                    raise
+                pause = self.delay(attempt)
+                if deadline is not None and time.monotonic() + pause >= deadline:
+                    raise
+                print(f"retrying after {type(e).__name__} in {pause:.2f}s")
+                attempt += 1
+                await asyncio.sleep(pause)
+
+    def exhausted(self, round_trips, deadline):
+        """Why the question must stop before another Gemini call, or None."""
+        if round_trips >= self.max_round_trips:
+            return f"round trip limit ({self.max_round_trips}) reached"
+        if time.monotonic() >= deadline:
+            return f"time limit ({self.max_seconds}s) reached"
+        return None
+
+    def deadline(self):
+        return time.monotonic() + self.max_seconds
+
+    def hint(self, error, sql=None):
+        """Short, schema-aware text sent back to the model instead of the raw error."""
+        kind = classify(error)
+        message = _trim(error)
+        if kind == "unknown_column":
+            name = next(p.search(str(error)).group(1) for p in _UNKNOWN_COLUMN if p.search(str(error)))
+            return f"SQL error ({kind}): {message}{self._column_hint(name, sql)}"
+        if kind == "unknown_table":
+            match = next(p.search(str(error)) for p in _UNKNOWN_TABLE if p.search(str(error)))
+            return f"SQL error ({kind}): {message}{self._table_hint(match.groups()[-1])}"
+        if kind == "syntax":
+            return (
+                f"SQL error ({kind}): {message}. "
+                f"Use BigQuery Standard SQL and fully qualified {self.dataset_id}.table names."
+            )
+        if kind == "timeout":
+            return f"{message or 'The call timed out'}. Narrow the query with a date filter or fewer columns."
+        if kind == "resources":
+            return (
+                f"{kind}: {message.rstrip('.')}. Retrying will not help: aggregate with GROUP BY instead of returning rows, "
+                "add LIMIT to any ORDER BY, and filter on a date column."
+            )
+        if kind in ("bytes_limit", "transient"):
+            return f"{kind}: {message}"
+        return message or type(error).__name__
+
+    def _tables(self):
+        try:
+            return list(self.tools.list_tables(self.dataset_id))
+        except Exception:
+            return []
+
+    def _columns(self, table_name):
+        try:
+            resource = self.tools.get_table(f"{self.dataset_id}.{table_name}")
+        except Exception:
+            return []
+        return [f["name"] for f in resource.get("schema", {}).get("fields", [])]
+
+    def _column_hint(self, name, sql):
+        if self.tools is None:
+            return ""
+        tables = [t.split(".")[1] for t in referenced_tables(sql or "")] or self._tables()
+        columns = {table: self._columns(table) for table in tables}
+        candidates = [c for cols in columns.values() for c in cols]
+        close = difflib.get_close_matches(name, candidates, n=3, cutoff=0.6)
+        hint = f". Did you mean {', '.join(close)}?" if close else "."
+        listing = "; ".join(f"{self.dataset_id}.{t}({', '.join(c)})" for t, c in columns.items() if c)
+        return hint + (f" Columns: {listing}" if listing else "")
+
+    def _table_hint(self, name):
+        if self.tools is None:
+            return ""
+        tables = self._tables()
+        close = sorted(
+            (t for t in tables if _name_similarity(name, t) >= 0.6),
+            key=lambda t: -_name_similarity(name, t),
+        )[:3]
+        hint = f". Did you mean {', '.join(self.dataset_id + '.' + t for t in close)}?" if close else "."
+        return hint + (f" Tables: {', '.join(tables)}" if tables else "")
@@ -0,0 +1,196 @@
+"""Clients shared by every Streamlit session in the process.
+
+BigQuery clients are pooled and handed out one per chat turn; each client
+keeps its own keep-alive HTTP session, so auth and TLS handshakes are paid
+once per pooled client rather than once per message. The Gemini model is
+created lazily and reused across reruns and users. The Google SDKs are
+imported on first use, not when this module is imported.
+"""
+import contextlib
+import datetime
+import functools
+import hashlib
+import queue
+import threading
+import time
+
+BIGQUERY_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+DEFAULT_POOL_SIZE = 8
+HTTP_POOL_MAXSIZE = 16
+
+
+@functools.lru_cache(maxsize=None)
+def counting_adapter_class():
+    """``HTTPAdapter`` that reports how often urllib3 reused a connection.
+
+    Defined on first use: requests is only needed once a BigQuery client is built.
+    """
+    from requests.adapters import HTTPAdapter
+
+    class CountingAdapter(HTTPAdapter):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.requests_sent = 0
+
+        def send(self, request, **kwargs):
+            self.requests_sent += 1
+            return super().send(request, **kwargs)
+
+        def connections_opened(self):
+            pools = self.poolmanager.pools
+            return sum(pool.num_connections for pool in (pools.get(key) for key in pools.keys()) if pool)
+
+    return CountingAdapter
+
+
+class BigQueryPool:
+    def __init__(self, project, size=DEFAULT_POOL_SIZE, http_pool_maxsize=HTTP_POOL_MAXSIZE):
+        self.project = project
+        self.size = size
+        self.http_pool_maxsize = http_pool_maxsize
+        self._credentials = None
+        self._read_client = None
+        self._idle = queue.LifoQueue()
+        self._adapters = []
+        self._created = 0
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+
+    def create_client(self):
+        import google.auth
+        from google.auth.transport.requests import AuthorizedSession
+        from google.cloud import bigquery
+
+        with self._lock:
+            if self._credentials is None:
+                self._credentials, _ = google.auth.default(scopes=BIGQUERY_SCOPES)
+            adapter = counting_adapter_class()(
+                pool_connections=4, pool_maxsize=self.http_pool_maxsize, max_retries=3
+            )
+            self._adapters.append(adapter)
+        session = AuthorizedSession(self._credentials)
+        session.mount("https://", adapter)
+        return bigquery.Client(project=self.project, credentials=self._credentials, _http=session)
+
+    def read_client(self):
+        """The Storage Read API client, shared by every thread (gRPC clients are), or None."""
+        try:
+            from google.cloud import bigquery_storage
+        except ImportError:  # only needed for large columnar results
+            return None
+        import google.auth
+
+        with self._lock:
+            if self._read_client is None:
+                if self._credentials is None:
+                    self._credentials, _ = google.auth.default(scopes=BIGQUERY_SCOPES)
+                self._read_client = bigquery_storage.BigQueryReadClient(credentials=self._credentials)
+            return self._read_client
+
+    def acquire(self, timeout=None):
+        with self._lock:
+            self.checkouts += 1
+            grow = self._idle.empty() and self._created < self.size
+            if grow:
+                self._created += 1
+        if grow:
+            try:
+                return self.create_client()
+            except BaseException:
+                # the slot was never filled; without this a later acquire waits forever
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self.waits += 1
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"no BigQuery client free after {timeout} s") from None
+
+    def release(self, client):
+        self._idle.put(client)
+
+    @contextlib.contextmanager
+    def client(self, timeout=None):
+        client = self.acquire(timeout=timeout)
+        try:
+            yield client
+        finally:
+            self.release(client)
+
+    def stats(self):
+        with self._lock:
+            adapters = list(self._adapters)
+            result = {
+                "clients": self._created,
+                "idle": self._idle.qsize(),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+            }
+        requests_sent = sum(a.requests_sent for a in adapters)
+        connections = sum(a.connections_opened() for a in adapters)
+        result["http_requests"] = requests_sent
+        result["http_connections"] = connections
+        result["connection_reuse"] = 1 - connections / requests_sent if requests_sent else 0.0
+        return result
+
+
+_pools = {}
+_models = {}
+_cached_models = {}
+_registry_lock = threading.Lock()
+
+
+def get_bigquery_pool(project, size=DEFAULT_POOL_SIZE):
+    with _registry_lock:
+        if project not in _pools:
+            _pools[project] = BigQueryPool(project, size=size)
+        return _pools[project]
+
+
+def get_model(model_name, **kwargs):
+    """Create the GenerativeModel on first use and hand back the same one afterwards."""
+    from vertexai.generative_models import GenerativeModel
+
+    with _registry_lock:
+        if model_name not in _models:
+            _models[model_name] = GenerativeModel(model_name, **kwargs)
+        return _models[model_name]
+
+
+def get_cached_model(model_name, system_instruction, tools, ttl_seconds, **kwargs):
+    """A model whose system instruction and tools are read from a Vertex context cache.
+
+    The static prefix is then billed at the cached rate instead of in full on
+    every request. Returns None when the cache cannot be created (e.g. the
+    prefix is under the minimum cacheable size); that answer is remembered
+    for ``ttl_seconds`` too, so a failing cache costs one call, not one per turn.
+    """
+    key = (model_name, hashlib.sha256(system_instruction.encode("utf-8")).hexdigest())
+    with _registry_lock:
+        entry = _cached_models.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+    try:
+        from vertexai.generative_models import GenerativeModel
+        from vertexai.preview import caching
+
+        cached_content = caching.CachedContent.create(
+            model_name=model_name,
+            system_instruction=system_instruction,
+            tools=tools,
+            ttl=datetime.timedelta(seconds=ttl_seconds),
+        )
+        model = GenerativeModel.from_cached_content(cached_content=cached_content, **kwargs)
+    except Exception as e:
+        print("context cache unavailable: " + str(e))
+        model = None
+    with _registry_lock:
+        # renew a little before Vertex drops the cache
+        _cached_models[key] = (time.monotonic() + ttl_seconds * 0.9, model)
+    return model
@@ -0,0 +1,260 @@
+"""Two-tier cache for query results and whole answers.
+
+Tier 1 is an exact match on the normalized SQL the model sends to sql_query.
+Tier 2 matches a new prompt against earlier prompts that ask the same thing
+in other words and hands back the earlier SQL and answer, so repeated
+questions skip both the Gemini loop and the BigQuery job. Two prompts are
+the same when they differ only in stopwords and filler ("how many", "I
+want"); any other word is a value ("lab" vs "imaging", "2 days" vs "3 days")
+and makes it a different question. ``prompt_key`` is that set of words, so a
+lookup is one ``get`` by key instead of a scan over earlier prompts.
+
+Entries that depend on the current date (CURRENT_DATE, "last week", ...)
+expire at the next midnight at the latest.
+"""
+import collections
+import datetime
+import hashlib
+import json
+import re
+import threading
+import time
+
+try:
+    import redis
+except ImportError:  # only needed for the Redis-protocol backend
+    redis = None
+
+DEFAULT_TTL_SECONDS = 60 * 60
+DEFAULT_MAX_ENTRIES = 1000
+HISTORICAL_TTL_SECONDS = 7 * 24 * 60 * 60
+
+_RELATIVE_DATE_SQL = re.compile(
+    r"\b(current_date|current_datetime|current_timestamp|now)\b", re.IGNORECASE
+)
+_RELATIVE_DATE_PROMPT = re.compile(
+    r"\b(today|yesterday|last|past|this|recent|recently|ago)\b", re.IGNORECASE
+)
+_DATE_LITERAL = re.compile(r"'(\d{4}-\d{2}-\d{2})'")
+_STRING_LITERAL = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")")
+_STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "me", "is", "are", "was",
+    "were", "be", "by", "with", "and", "or", "all", "please", "get", "give",
+    "show", "what", "can", "you", "tell", "list", "do", "does", "there",
+}
+# change how a question is phrased, not what it asks for
+_FILLER = {
+    "how", "many", "much", "number", "count", "total", "i", "we", "want",
+    "need", "see", "find", "know", "could", "would", "kindly", "some",
+}
+
+
+def normalize_sql(sql):
+    """Lowercase and collapse whitespace and punctuation spacing outside of string literals."""
+    sql = sql.strip().rstrip(";").replace("`", "")
+    parts = _STRING_LITERAL.split(sql)
+    for i in range(0, len(parts), 2):
+        part = re.sub(r"\s+", " ", parts[i]).lower()
+        parts[i] = re.sub(r"\s*([(),=<>])\s*", r"\1", part)
+    return "".join(parts).strip()
+
+
+def prompt_tokens(prompt):
+    tokens = set()
+    for token in re.findall(r"[a-z0-9]+", prompt.lower()):
+        if token in _STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s"):
+            token = token[:-1]
+        tokens.add(token)
+    return tokens
+
+
+def prompt_key(prompt):
+    """The words that decide what a prompt asks for; equal keys are the same question."""
+    return " ".join(sorted(prompt_tokens(prompt) - _FILLER))
+
+
+def seconds_until_midnight(now=None):
+    now = now or datetime.datetime.now()
+    midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+    return max(1, int((midnight - now).total_seconds()))
+
+
+def ttl_for(sql="", prompt="", default=DEFAULT_TTL_SECONDS):
+    """Results relative to today must not outlive today."""
+    if _RELATIVE_DATE_SQL.search(sql or "") or _RELATIVE_DATE_PROMPT.search(prompt or ""):
+        return min(default, seconds_until_midnight())
+    return default
+
+
+def window_ttl(sql="", prompt="", default=DEFAULT_TTL_SECONDS, today=None):
+    """Lifetime tied to the date window a query covers, for precomputed entries.
+
+    A window relative to today is valid until midnight; a window that ended
+    before today only changes when data is loaded, which the cache warmer
+    handles by clearing the cache.
+    """
+    if _RELATIVE_DATE_SQL.search(sql or "") or _RELATIVE_DATE_PROMPT.search(prompt or ""):
+        return seconds_until_midnight()
+    today = today or datetime.date.today()
+    dates = [datetime.date.fromisoformat(d) for d in _DATE_LITERAL.findall(sql or "")]
+    if dates and max(dates) < today:
+        return HISTORICAL_TTL_SECONDS
+    return default
+
+
+def _key(prefix, text):
+    return prefix + hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+class InMemoryBackend:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, clock=time.monotonic):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl_seconds):
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def keys(self, prefix=""):
+        with self._lock:
+            return [k for k in reversed(self._entries) if k.startswith(prefix)]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend:
+    """Backend for Redis or any local server speaking the Redis protocol.
+
+    Recency is tracked in a sorted set so the size bound evicts the least
+    recently used key, independent of the server's own eviction policy.
+    """
+
+    def __init__(self, url, max_entries=DEFAULT_MAX_ENTRIES, namespace="chat-cache:"):
+        if redis is None:
+            raise RuntimeError("the redis package is required for RedisBackend")
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self._lru_key = namespace + "lru"
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._redis.get(self.namespace + key)
+        if raw is None:
+            self._redis.zrem(self._lru_key, key)
+            return None
+        self._redis.zadd(self._lru_key, {key: time.time()})
+        return json.loads(raw)
+
+    def set(self, key, value, ttl_seconds):
+        pipe = self._redis.pipeline()
+        pipe.set(self.namespace + key, json.dumps(value, default=str), ex=max(1, int(ttl_seconds)))
+        pipe.zadd(self._lru_key, {key: time.time()})
+        pipe.execute()
+        overflow = self._redis.zcard(self._lru_key) - self.max_entries
+        if overflow > 0:
+            for old in self._redis.zrange(self._lru_key, 0, overflow - 1):
+                self.delete(old.decode("utf-8"))
+
+    def delete(self, key):
+        self._redis.delete(self.namespace + key)
+        self._redis.zrem(self._lru_key, key)
+
+    def keys(self, prefix=""):
+        keys = [k.decode("utf-8") for k in self._redis.zrevrange(self._lru_key, 0, -1)]
+        return [k for k in keys if k.startswith(prefix)]
+
+    def clear(self):
+        for key in self.keys():
+            self.delete(key)
+
+
+class ResultCache:
+    def __init__(self, backend=None, default_ttl=DEFAULT_TTL_SECONDS):
+        self.backend = backend or InMemoryBackend()
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self.counters = collections.Counter()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    # tier 1: exact normalized SQL
+    def get_query(self, sql):
+        value = self.backend.get(_key("sql:", normalize_sql(sql)))
+        self._count("sql_hits" if value is not None else "sql_misses")
+        return None if value is None else value["result"]
+
+    def put_query(self, sql, result, ttl_seconds=None):
+        ttl_seconds = ttl_seconds or ttl_for(sql=sql, default=self.default_ttl)
+        self.backend.set(_key("sql:", normalize_sql(sql)), {"sql": sql, "result": result}, ttl_seconds)
+
+    def extend_query(self, sql, ttl_seconds):
+        """Keep an existing result for ``ttl_seconds``; False if it is not cached."""
+        key = _key("sql:", normalize_sql(sql))
+        value = self.backend.get(key)
+        if value is None:
+            return False
+        self.backend.set(key, value, ttl_seconds)
+        return True
+
+    def delete_query(self, sql):
+        self.backend.delete(_key("sql:", normalize_sql(sql)))
+
+    # tier 2: the same prompt in other words
+    def get_answer(self, prompt):
+        """Return ``{"prompt", "sql", "answer"}`` of an earlier prompt with the same ``prompt_key``."""
+        key = prompt_key(prompt)
+        value = self.backend.get(_key("prompt:", key)) if key else None
+        self._count("prompt_hits" if value is not None else "prompt_misses")
+        return value
+
+    def put_answer(self, prompt, sql, answer, ttl_seconds=None):
+        ttl_seconds = ttl_seconds or min(
+            ttl_for(sql=sql or "", default=self.default_ttl),
+            ttl_for(prompt=prompt, default=self.default_ttl),
+        )
+        key = prompt_key(prompt)
+        if not key:
+            return
+        self.backend.set(_key("prompt:", key), {"prompt": prompt, "sql": sql, "answer": answer}, ttl_seconds)
+
+    def delete_answer(self, prompt):
+        self.backend.delete(_key("prompt:", prompt_key(prompt)))
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+def backend_from_url(url, max_entries=DEFAULT_MAX_ENTRIES, namespace="chat-cache:"):
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url, max_entries=max_entries, namespace=namespace)
+    return InMemoryBackend(max_entries=max_entries)
@@ -0,0 +1,261 @@
+"""Precomputed rollup tables for the common clinical questions, and a router onto them.
+
+Three tables are kept next to the raw UDMH tables:
+
+- ``rollup_daily_orders``: order counts per order_date, order_type and
+  department_name
+- ``rollup_encounter_stays``: one row per encounter with its length of stay
+  and the days since the same patient's previous discharge (readmissions)
+- ``rollup_daily_reason_stays``: encounters and stay days per admission
+  date and reason
+
+``RollupManager.refresh`` recomputes only the trailing window since the
+last refresh (plus a lookback for late rows) and swaps it in with a single
+``CREATE OR REPLACE TABLE`` statement: readers see the old table or the new
+one, never a half-written one, and a refresh that fails leaves the old table
+in place. Only instances started with ``ROLLUP_REFRESH=1`` refresh (and
+route, once their first refresh succeeded); if several do, each writes a
+complete table (the last one wins) instead of adding its own copy of the
+window.
+
+``route`` rewrites sql_query calls that a rollup fully answers, and
+``ROLLUP_HINTS`` steers the model towards the rollups for the rest. The SQL is BigQuery's; the local backend
+translates it like any other query.
+"""
+import datetime
+import re
+import threading
+import time
+
+from cost_guard import referenced_tables
+
+DEFAULT_DATASET_ID = "UDMH"
+LOOKBACK_DAYS = 3
+
+ORDERS_TABLE = "rollup_daily_orders"
+STAYS_TABLE = "rollup_encounter_stays"
+REASONS_TABLE = "rollup_daily_reason_stays"
+
+ROLLUP_HINTS = (
+    "Precomputed rollups, prefer them over the raw tables when they answer the question: "
+    f"UDMH.{ORDERS_TABLE}(order_date, order_type, department_name, order_count) for order counts; "
+    f"UDMH.{STAYS_TABLE}(encounter_id, patient_id, admission_date, discharge_date, department_name, "
+    "reason, provider_id, los_days, prev_discharge_date, days_since_prev_discharge) for length of stay "
+    "and readmissions; "
+    f"UDMH.{REASONS_TABLE}(admission_date, reason, encounters, total_los_days, max_los_days) "
+    "for stay length by reason."
+)
+
+_ORDERS_SELECT = """
+SELECT order_date, order_type, department_name, COUNT(*) AS order_count
+FROM {ds}.clncl_ordr_dim
+WHERE order_date >= {start}
+GROUP BY order_date, order_type, department_name
+"""
+
+_STAYS_SELECT = """
+SELECT * FROM (
+  SELECT encounter_id, patient_id, admission_date, discharge_date, department_name, reason, provider_id,
+    DATE_DIFF(discharge_date, admission_date, DAY) AS los_days,
+    LAG(discharge_date) OVER (PARTITION BY patient_id ORDER BY admission_date, encounter_id) AS prev_discharge_date,
+    DATE_DIFF(admission_date, LAG(discharge_date) OVER (PARTITION BY patient_id ORDER BY admission_date, encounter_id), DAY)
+      AS days_since_prev_discharge
+  FROM {ds}.encounter_dim
+  WHERE patient_id IN (SELECT patient_id FROM {ds}.encounter_dim WHERE admission_date >= {start})
+)
+"""
+
+_REASONS_SELECT = """
+SELECT admission_date, reason, COUNT(*) AS encounters, SUM(los_days) AS total_los_days,
+  MAX(los_days) AS max_los_days
+FROM {ds}.{stays}
+WHERE admission_date >= {start}
+GROUP BY admission_date, reason
+"""
+
+_EPOCH = "DATE '1900-01-01'"
+
+
+def _date_literal(value):
+    if isinstance(value, str):
+        value = datetime.date.fromisoformat(value[:10])
+    return f"DATE '{value.isoformat()}'"
+
+
+class RollupManager:
+    """Builds and refreshes the rollups through ``executor.execute(sql)``.
+
+    ``execute`` returns the result rows as tuples (empty for DDL/DML); both
+    ``BigQueryTools`` and ``LocalTools`` provide it.
+    """
+
+    def __init__(self, executor, dataset_id=DEFAULT_DATASET_ID, lookback_days=LOOKBACK_DAYS):
+        self.executor = executor
+        self.dataset_id = dataset_id
+        self.lookback_days = lookback_days
+        self.refreshed_at = None
+        self._lock = threading.Lock()
+
+    def _watermark(self, table, column):
+        try:
+            rows = self.executor.execute(f"SELECT MAX({column}) FROM {self.dataset_id}.{table}")
+        except Exception:
+            return None  # not built yet
+        value = rows[0][0] if rows else None
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = datetime.date.fromisoformat(value[:10])
+        return value - datetime.timedelta(days=self.lookback_days)
+
+    def _refresh_table(self, table, select, date_column, window_filter):
+        ds = self.dataset_id
+        start = self._watermark(table, date_column)
+        if start is None:
+            self.executor.execute(
+                f"CREATE OR REPLACE TABLE {ds}.{table} AS " + select.format(ds=ds, start=_EPOCH, stays=STAYS_TABLE)
+            )
+            return "built"
+        start = _date_literal(start)
+        # the rows outside the window, plus the window recomputed, in one statement
+        self.executor.execute(
+            f"CREATE OR REPLACE TABLE {ds}.{table} AS "
+            f"SELECT * FROM {ds}.{table} WHERE NOT COALESCE({window_filter.format(ds=ds, start=start)}, FALSE) "
+            "UNION ALL " + select.format(ds=ds, start=start, stays=STAYS_TABLE)
+        )
+        return "refreshed"
+
+    def refresh(self):
+        """Bring all rollups up to date; returns what was done per table."""
+        with self._lock:
+            done = {
+                ORDERS_TABLE: self._refresh_table(
+                    ORDERS_TABLE, _ORDERS_SELECT, "order_date", "order_date >= {start}"
+                ),
+                # a new encounter changes the readmission gap of the patient's later rows
+                STAYS_TABLE: self._refresh_table(
+                    STAYS_TABLE, _STAYS_SELECT, "admission_date",
+                    "patient_id IN (SELECT patient_id FROM {ds}.encounter_dim WHERE admission_date >= {start})",
+                ),
+                REASONS_TABLE: self._refresh_table(
+                    REASONS_TABLE, _REASONS_SELECT, "admission_date", "admission_date >= {start}"
+                ),
+            }
+            self.refreshed_at = time.time()
+            return done
+
+    def refresh_if_stale(self, max_age_seconds):
+        if self.refreshed_at is None or time.time() - self.refreshed_at > max_age_seconds:
+            return self.refresh()
+        return None
+
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'")
+_IDENTIFIER = re.compile(r"\b([A-Za-z_][A-Za-z0-9_]*)\b(\s*\()?")
+_ALIAS = re.compile(r"\bAS\s+([A-Za-z_][A-Za-z0-9_]*)", re.IGNORECASE)
+_TABLE_REF = r"`?(?:[\w-]+\.)?{ds}\.{table}`?"
+_KEYWORDS = {
+    "select", "from", "where", "and", "or", "not", "group", "by", "order", "asc", "desc", "limit",
+    "as", "between", "in", "is", "null", "date", "interval", "day", "week", "month", "year",
+    "having", "current_date", "true", "false", "like", "offset", "case", "when", "then", "else",
+    "end", "quarter", "isoweek",
+}
+_ORDER_COLUMNS = {"order_date", "order_type", "department_name"}
+_STAY_COLUMNS = {
+    "encounter_id", "patient_id", "admission_date", "discharge_date", "department_name", "reason",
+    "provider_id",
+}
+_LOS = re.compile(r"DATE_DIFF\s*\(\s*discharge_date\s*,\s*admission_date\s*,\s*DAY\s*\)", re.IGNORECASE)
+# COUNT(order_id) is not COUNT(*) when order_id is NULL, so only these two are rewritten
+_COUNT = re.compile(r"COUNT\s*\(\s*(\*|1)\s*\)", re.IGNORECASE)
+_NOT_FLAT = re.compile(r"\b(JOIN|DISTINCT|OVER|WITH|UNION|INTERSECT|EXCEPT)\b|\(\s*SELECT\b", re.IGNORECASE)
+# EXTRACT(MONTH FROM order_date) is not a second FROM clause
+_EXTRACT_FROM = re.compile(r"\bEXTRACT\s*\(\s*(\w+)\s+FROM\b", re.IGNORECASE)
+_SELECT_LIST = re.compile(r"^\s*SELECT\s+(.*?)\s+FROM\b", re.IGNORECASE | re.DOTALL)
+_GROUP_BY = re.compile(
+    r"\bGROUP\s+BY\s+(.*?)\s*(?:\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|$)", re.IGNORECASE | re.DOTALL
+)
+_ITEM_ALIAS = re.compile(r"\s+AS\s+([A-Za-z_][A-Za-z0-9_]*)\s*$", re.IGNORECASE)
+
+
+def _columns(sql, dataset_id):
+    """Identifiers used as columns: not keywords, functions, aliases or the dataset."""
+    sql = _STRING.sub("''", sql)
+    aliases = {a.lower() for a in _ALIAS.findall(sql)}
+    sql = re.sub(r"`?(?:[\w-]+\.)?" + dataset_id + r"\.\w+`?", " ", sql)
+    found = set()
+    for name, call in _IDENTIFIER.findall(sql):
+        name = name.lower()
+        if call or name in _KEYWORDS or name in aliases:
+            continue
+        found.add(name)
+    return found
+
+
+def _split_items(text):
+    """Split a select or GROUP BY list on its top-level commas."""
+    items, depth, current = [], 0, ""
+    for char in _STRING.sub("''", text):
+        depth += {"(": 1, ")": -1}.get(char, 0)
+        if char == "," and depth == 0:
+            items.append(current.strip())
+            current = ""
+        else:
+            current += char
+    return items + [current.strip()]
+
+
+def _counts_per_group(sql, dataset_id):
+    """True when the select list is COUNTs plus columns that are all grouped by.
+
+    The order rollup has one row per day, type and department; only then does
+    summing its counts give the same rows as the raw query.
+    """
+    select = _SELECT_LIST.search(_EXTRACT_FROM.sub(r"EXTRACT(\1,", sql))
+    if select is None or not _COUNT.search(select.group(1)):
+        return False
+    items = _split_items(select.group(1))
+    aliases = {}
+    for item in items:
+        alias = _ITEM_ALIAS.search(item)
+        if alias:
+            aliases[alias.group(1).lower()] = item
+    grouped = set()
+    group_by = _GROUP_BY.search(sql)
+    for item in _split_items(group_by.group(1)) if group_by else ():
+        if item.isdigit() and 0 < int(item) <= len(items):
+            item = items[int(item) - 1]  # GROUP BY 1
+        grouped |= _columns(aliases.get(item.lower(), item), dataset_id)
+    return all(_COUNT.search(item) or _columns(item, dataset_id) <= grouped for item in items)
+
+
+def route(sql, dataset_id=DEFAULT_DATASET_ID):
+    """Return ``sql`` rewritten onto a rollup, or None when no rollup covers it."""
+    tables = referenced_tables(sql)
+    bare = _EXTRACT_FROM.sub(r"EXTRACT(\1,", _STRING.sub("''", sql))
+    if len(tables) != 1 or _NOT_FLAT.search(bare):
+        return None
+    # a subquery's columns are not the rollup's: route only flat single-SELECT queries
+    if len(re.findall(r"\bFROM\b", bare, re.IGNORECASE)) != 1:
+        return None
+    table = tables[0].split(".")[1]
+
+    if table == "clncl_ordr_dim":
+        # COUNT(*) is the only aggregate the daily order rollup can answer
+        without_counts = _COUNT.sub("", sql)
+        if re.search(r"\b(SUM|AVG|MIN|MAX|COUNT)\s*\(", without_counts, re.IGNORECASE):
+            return None
+        if not _columns(without_counts, dataset_id) <= _ORDER_COLUMNS:
+            return None
+        if not _counts_per_group(sql, dataset_id):
+            return None
+        routed = _COUNT.sub("COALESCE(SUM(order_count), 0)", sql)
+        return re.sub(_TABLE_REF.format(ds=dataset_id, table=table), f"{dataset_id}.{ORDERS_TABLE}", routed)
+
+    if table == "encounter_dim" and _LOS.search(sql):
+        routed = _LOS.sub("los_days", sql)
+        if not _columns(routed, dataset_id) <= _STAY_COLUMNS | {"los_days"}:
+            return None
+        return re.sub(_TABLE_REF.format(ds=dataset_id, table=table), f"{dataset_id}.{STAYS_TABLE}", routed)
+
+    return None
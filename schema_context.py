@@ -0,0 +1,78 @@
+"""Compact schema digest that lets the model skip the discovery round trips.
+
+Instead of letting Gemini walk list_datasets -> list_tables -> get_table
+before every sql_query, the digest built here (table names, columns with
+types and join keys) is put in front of the first message.
+"""
+import collections
+import math
+import threading
+
+
+def build_schema_digest(metadata_cache, dataset_id):
+    columns_by_table = {}
+    for table_name in metadata_cache.list_tables(dataset_id):
+        resource = metadata_cache.get_table(f"{dataset_id}.{table_name}")
+        fields = resource.get("schema", {}).get("fields", [])
+        columns_by_table[table_name] = [(f["name"], f.get("type", "STRING")) for f in fields]
+
+    key_tables = collections.defaultdict(list)
+    for table_name, columns in columns_by_table.items():
+        for name, _ in columns:
+            if name.endswith("_id"):
+                key_tables[name].append(table_name)
+
+    lines = [f"Schema of the {dataset_id} dataset (use fully qualified names like {dataset_id}.table):"]
+    for table_name, columns in sorted(columns_by_table.items()):
+        cols = ", ".join(f"{name} {type_}" for name, type_ in columns)
+        lines.append(f"- {dataset_id}.{table_name}({cols})")
+    joins = [
+        f"{key}: {', '.join(sorted(tables))}"
+        for key, tables in sorted(key_tables.items())
+        if len(tables) > 1
+    ]
+    if joins:
+        lines.append("Join keys: " + "; ".join(joins))
+    lines.append("The schema above is current, call sql_query directly without listing datasets or tables.")
+    return "\n".join(lines)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class RoundTripRecorder:
+    """Keeps the last questions' round trips and latency, grouped by mode."""
+
+    def __init__(self, maxlen=500):
+        self._samples = collections.deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, mode, round_trips, latency_seconds):
+        with self._lock:
+            self._samples.append((mode, round_trips, latency_seconds))
+
+    def summary(self):
+        with self._lock:
+            samples = list(self._samples)
+        by_mode = collections.defaultdict(list)
+        for mode, round_trips, latency in samples:
+            by_mode[mode].append((round_trips, latency))
+        result = {}
+        for mode, rows in by_mode.items():
+            trips = [r for r, _ in rows]
+            latencies = [l for _, l in rows]
+            result[mode] = {
+                "questions": len(rows),
+                "avg_round_trips": sum(trips) / len(trips),
+                "p50_seconds": percentile(latencies, 50),
+                "p95_seconds": percentile(latencies, 95),
+            }
+        return result
+
+
+round_trip_recorder = RoundTripRecorder()
@@ -0,0 +1,134 @@
+"""Bounded, incremental serialization of query results for the model.
+
+Rows are written one at a time as CSV (header first) until a row or byte
+budget is reached. Rows past the budget are still counted and folded into
+per-column summary stats, but never kept, so a careless ``SELECT *`` costs
+neither memory nor context tokens.
+"""
+import csv
+import datetime
+import decimal
+import io
+
+from tracing import span
+
+MAX_ROWS = 200
+MAX_BYTES = 16000
+# rows fetched in one page, and the most rows read to compute summary stats
+PAGE_SIZE = 1000
+SCAN_ROWS = 20000
+
+
+def _format_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value)
+
+
+class _ColumnStats:
+    def __init__(self):
+        self.nulls = 0
+        self.minimum = None
+        self.maximum = None
+        self.total = 0
+        self.numeric = 0
+
+    def add(self, value):
+        if value is None:
+            self.nulls += 1
+            return
+        if isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool):
+            self.total += value
+            self.numeric += 1
+        elif not isinstance(value, (datetime.date, datetime.datetime)):
+            return
+        try:
+            if self.minimum is None or value < self.minimum:
+                self.minimum = value
+            if self.maximum is None or value > self.maximum:
+                self.maximum = value
+        except TypeError:
+            pass
+
+    def describe(self, name):
+        if self.minimum is None:
+            return None
+        parts = [f"min={_format_value(self.minimum)}", f"max={_format_value(self.maximum)}"]
+        if self.numeric:
+            parts.append(f"avg={_format_value(float(self.total) / self.numeric)}")
+        if self.nulls:
+            parts.append(f"nulls={self.nulls}")
+        return f"{name} " + " ".join(parts)
+
+
+class ResultWriter:
+    def __init__(self, names, max_rows=MAX_ROWS, max_bytes=MAX_BYTES):
+        self.names = list(names)
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.rows_seen = 0
+        self.rows_written = 0
+        self._stats = [_ColumnStats() for _ in self.names]
+        self._chunks = []
+        self._size = 0
+        self._full = False
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        self._write(self.names)
+
+    def _write(self, values):
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._writer.writerow(values)
+        line = self._buffer.getvalue()
+        if self._size + len(line) > self.max_bytes:
+            return False
+        self._chunks.append(line)
+        self._size += len(line)
+        return True
+
+    def add(self, values):
+        values = tuple(values)
+        self.rows_seen += 1
+        for stats, value in zip(self._stats, values):
+            stats.add(value)
+        self.append(values)
+
+    def append(self, values):
+        """Write a row without counting it or adding it to the summary stats."""
+        if self._full:
+            return
+        if self.rows_written >= self.max_rows or not self._write([_format_value(v) for v in values]):
+            self._full = True
+            return
+        self.rows_written += 1
+
+    def finish(self, total_rows=None, scanned=None, described=None):
+        """``scanned`` and ``described`` override the row count and stats gathered by ``add``."""
+        scanned = self.rows_seen if scanned is None else scanned
+        total_rows = max(total_rows or 0, scanned)
+        text = "".join(self._chunks)
+        if self.rows_written < total_rows:
+            text += f"[truncated: {self.rows_written} of {total_rows} rows shown]\n"
+            if described is None:
+                described = [stats.describe(name) for name, stats in zip(self.names, self._stats)]
+            described = [d for d in described if d]
+            if described:
+                over = "" if scanned == total_rows else f" over the first {scanned} rows"
+                text += f"summary{over}: " + "; ".join(described) + "\n"
+        return text
+
+
+def serialize_rows(names, rows, total_rows=None, max_rows=MAX_ROWS, max_bytes=MAX_BYTES):
+    """Serialize an iterable of value tuples; ``rows`` is consumed lazily."""
+    with span("serialize") as s:
+        writer = ResultWriter(names, max_rows=max_rows, max_bytes=max_bytes)
+        for values in rows:
+            writer.add(values)
+        text = writer.finish(total_rows)
+        s.set(rows=writer.rows_seen, rows_written=writer.rows_written, bytes=len(text))
+    return text
@@ -0,0 +1,95 @@
+"""Share one execution among identical calls that are in flight at the same time.
+
+At shift change many users ask the same question within seconds. Without
+this every one of them runs the same BigQuery job, the same metadata
+lookups and the same Gemini turn. ``SingleFlight`` keeps a registry of the
+calls in flight by key (tool, normalized SQL or parameters): the first
+caller runs the call, identical callers that arrive before it finishes wait
+for its ``concurrent.futures.Future`` and get the same result or exception.
+Nothing is kept once the call finishes; that is what the caches are for.
+
+Threads block on the future (``do``); coroutines await it (``do_async``),
+from any event loop, so the Streamlit threads and the API share flights.
+"""
+import asyncio
+import concurrent.futures
+import threading
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def _join(self, key):
+        """Return ``(future, leader)``: the future of the call in flight for ``key``, or a new one to run."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._calls[key] = concurrent.futures.Future()
+            self.executed += 1
+            return future, True
+
+    def _leave(self, key, future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def forget(self, key):
+        """Let the next caller of ``key`` run it again instead of joining the call in flight."""
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def do(self, key, function, *args):
+        """``function(*args)``, unless the same ``key`` is already running; then its result."""
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    return future.result()
+                except concurrent.futures.CancelledError:
+                    continue  # the first caller gave up, run it ourselves
+            try:
+                result = function(*args)
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            else:
+                future.set_result(result)
+                return result
+            finally:
+                self._leave(key, future)
+
+    async def do_async(self, key, make_call):
+        """``await make_call()``, unless the same ``key`` is already running; then its result."""
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    # shielded: a follower that is cancelled must not cancel the shared call
+                    return await asyncio.shield(asyncio.wrap_future(future))
+                except asyncio.CancelledError:
+                    if not future.cancelled():
+                        raise
+                    continue  # the first caller was cancelled, run it ourselves
+            try:
+                result = await make_call()
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            else:
+                future.set_result(result)
+                return result
+            finally:
+                self._leave(key, future)
+
+    def stats(self):
+        with self._lock:
+            return {"executed": self.executed, "coalesced": self.coalesced, "in_flight": len(self._calls)}
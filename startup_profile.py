@@ -0,0 +1,88 @@
+"""Where the milliseconds of a cold start go.
+
+    python startup_profile.py                      # import time of engine.py, by package
+    python startup_profile.py --module app --top 20
+    python startup_profile.py --build              # also build the engine and time each step
+    python startup_profile.py --build --question "Get me lab orders count for the last week?"
+
+Imports are measured in a fresh interpreter with ``python -X importtime``.
+``--build`` then builds the engine in this process the way a new instance
+does (the same environment variables apply, ``QUERY_BACKEND=local`` works
+offline) and prints the ``startup`` trace; ``--question`` answers one
+question after that and prints its timeline too.
+"""
+import argparse
+import asyncio
+import collections
+import os
+import re
+import subprocess
+import sys
+import time
+
+_REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def import_times(module):
+    """``[(name, self_us, cumulative_us, depth)]`` for every module ``import module`` loads."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=_REPO_DIR,  # ``-c`` puts the working directory on sys.path
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    entries = []
+    for line in completed.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            entries.append((name, int(own), int(cumulative), (len(indent) - 1) // 2))
+    return entries
+
+
+def report_imports(module, top):
+    entries = import_times(module)
+    total = next((cumulative for name, _, cumulative, _ in entries if name == module), 0)
+    packages = collections.Counter()
+    for name, own, _, _ in entries:
+        packages[name.split(".")[0]] += own
+    print(f"import {module}: {total / 1000:.0f} ms, {len(entries)} modules")
+    print("by package (own time):")
+    for package, own in packages.most_common(top):
+        print(f"  {package:<32} {own / 1000:8.1f} ms")
+    print("slowest imports (including what they import):")
+    for name, _, cumulative, depth in sorted(entries, key=lambda e: -e[2])[:top]:
+        print(f"  {'  ' * min(depth, 4)}{name:<{32 - 2 * min(depth, 4)}} {cumulative / 1000:8.1f} ms")
+
+
+def report_build(question=None):
+    started = time.perf_counter()
+    import engine
+
+    imported = time.perf_counter()
+    chat_engine = engine.get_engine()
+    built = time.perf_counter()
+    print(f"import engine: {(imported - started) * 1000:.0f} ms, build: {(built - imported) * 1000:.0f} ms")
+    print(chat_engine.startup["timeline"])
+    if question:
+        reply = asyncio.run(chat_engine.ask(None, question))
+        print(f"first question ({reply['mode']}): {reply['seconds'] * 1000:.0f} ms")
+        print(reply["timeline"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="engine", help="module whose import is timed")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--build", action="store_true", help="build the engine and time each step")
+    parser.add_argument("--question", help="with --build, answer this question and time it")
+    args = parser.parse_args(argv)
+    report_imports(args.module, args.top)
+    if args.build:
+        report_build(args.question)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""Streaming Gemini turns and time-to-first-token tracking.
+
+Every chat turn is sent with ``stream=True``. If the model answers with
+function calls the stream is drained and the calls returned; if it answers
+with text, the text is handed to a callback chunk by chunk so the UI can
+render it while the rest is still being generated. The model may write a
+sentence before it decides to call a function; the callback then gets ""
+so the UI clears what it showed instead of leaving it as the answer.
+"""
+import collections
+import threading
+import time
+
+from cancellation import check
+from orchestrator import LlmReply
+from schema_context import percentile
+
+
+def has_function_call(part):
+    return "function_call" in part.to_dict()
+
+
+class GeminiChat:
+    """Adapts a vertexai ``ChatSession`` to the chat interface of ``orchestrator``.
+
+    Every function call part of a reply is returned, not just the first one.
+    """
+
+    def __init__(self, chat):
+        self.chat = chat
+
+    def send(self, content, on_text=None):
+        if not isinstance(content, str):
+            from vertexai.generative_models import Part
+
+            content = [
+                Part.from_function_response(name=name, response=response)
+                for name, response in content
+            ]
+        calls = []
+        text = ""
+        first_token_at = None
+        usage = None
+        # the chat history is only updated once the stream is fully consumed
+        for chunk in self.chat.send_message(content, stream=True):
+            check()  # the turn timed out
+            if chunk.usage_metadata and chunk.usage_metadata.prompt_token_count:
+                # the last chunk carries the totals for the whole request
+                usage = {
+                    "prompt": chunk.usage_metadata.prompt_token_count,
+                    "cached": getattr(chunk.usage_metadata, "cached_content_token_count", 0) or 0,
+                    "output": chunk.usage_metadata.candidates_token_count,
+                }
+            if not chunk.candidates:
+                continue
+            for part in chunk.candidates[0].content.parts:
+                if has_function_call(part):
+                    if text and not calls and on_text is not None:
+                        on_text("")
+                    calls.append((part.function_call.name, part.function_call.args))
+                    continue
+                piece = part.text
+                if piece and not calls:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    text += piece
+                    if on_text is not None:
+                        on_text(text)
+        return LlmReply(calls=calls, text="" if calls else text, first_token_at=first_token_at, usage=usage)
+
+
+class TtftRecorder:
+    def __init__(self, maxlen=500):
+        self._samples = collections.deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def summary(self):
+        with self._lock:
+            samples = list(self._samples)
+        return {
+            "requests": len(samples),
+            "p50_seconds": percentile(samples, 50),
+            "p95_seconds": percentile(samples, 95),
+        }
+
+
+ttft_recorder = TtftRecorder()
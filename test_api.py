@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("tornado")
+
+from api import Admission, Overloaded  # noqa: E402
+
+
+def test_requests_beyond_workers_and_queue_are_refused():
+    async def main():
+        admission = Admission(workers=2, max_queue=1, queue_timeout=5)
+        release = asyncio.Event()
+
+        async def request():
+            async with admission.slot():
+                await release.wait()
+
+        running = [asyncio.ensure_future(request()) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert admission.stats()["inflight"] == 2
+        assert admission.stats()["queued"] == 1
+        with pytest.raises(Overloaded):
+            async with admission.slot():
+                pass
+        release.set()
+        await asyncio.gather(*running)
+        return admission.stats()
+
+    stats = asyncio.run(main())
+    assert stats == {"workers": 2, "inflight": 0, "queued": 0, "completed": 3, "rejected": 1}
+
+
+def test_queued_request_gives_up_after_the_queue_timeout():
+    async def main():
+        admission = Admission(workers=1, max_queue=4, queue_timeout=0.05)
+        async with admission.slot():
+            with pytest.raises(Overloaded):
+                async with admission.slot():
+                    pass
+        return admission.stats()
+
+    stats = asyncio.run(main())
+    assert stats["rejected"] == 1
+    assert stats["queued"] == 0
@@ -0,0 +1,75 @@
+import asyncio
+import contextlib
+import threading
+import time
+
+from cancellation import attached
+from fakes import FakeChat, FakeTools
+from orchestrator import LlmReply, Orchestrator
+from policy import BUDGET_EXHAUSTED, ExecutionPolicy
+
+
+def test_calls_of_one_reply_run_in_parallel():
+    queries = {f"SELECT {i}": f"[{{'f0_': {i}}}]" for i in range(4)}
+    chat = FakeChat([
+        LlmReply(calls=[("sql_query", {"query": sql}) for sql in queries]),
+        LlmReply(text="done"),
+    ])
+    tools = FakeTools(queries=queries, latency=0.2)
+    started = time.perf_counter()
+    result = asyncio.run(Orchestrator(tools).run(chat, "four numbers"))
+    assert time.perf_counter() - started < 0.6
+    assert result.answer == "done"
+    assert [call.response for call in result.calls] == list(queries.values())
+    assert chat.sent[1] == [("sql_query", {"content": response}) for response in queries.values()]
+
+
+def test_call_timeout_is_reported_to_the_model():
+    chat = FakeChat([LlmReply(calls=[("sql_query", {"query": "SELECT 1"})]), LlmReply(text="too slow")])
+    tools = FakeTools(queries={"SELECT 1": "[]"}, latency=2)
+    result = asyncio.run(Orchestrator(tools, call_timeout=0.1).run(chat, "slow"))
+    assert result.answer == "too slow"
+    assert result.calls[0].error
+    assert result.calls[0].error_kind == "timeout"
+    assert "timed out" in chat.sent[1][0][1]["content"]
+
+
+class BlockingTools:
+    """A sync query that runs until it is cancelled, like a BigQuery job."""
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+
+    def query(self, sql):
+        with attached(self.cancelled.set):
+            self.cancelled.wait(5)
+        return "[]"
+
+
+def test_call_timeout_cancels_the_work_behind_it():
+    tools = BlockingTools()
+    chat = FakeChat([LlmReply(calls=[("sql_query", {"query": "SELECT 1"})]), LlmReply(text="")])
+    asyncio.run(Orchestrator(tools, call_timeout=0.1).run(chat, "slow"))
+    assert tools.cancelled.is_set()
+
+
+def test_turn_timeout_cancels_the_work_behind_it():
+    tools = BlockingTools()
+    chat = FakeChat([LlmReply(calls=[("sql_query", {"query": "SELECT 1"})]), LlmReply(text="")])
+
+    async def turn():
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(Orchestrator(tools).run(chat, "slow"), 0.1)
+
+    asyncio.run(turn())
+    assert tools.cancelled.is_set()
+
+
+def test_round_trip_budget_stops_the_turn():
+    chat = FakeChat([LlmReply(calls=[("list_datasets", {})]) for _ in range(10)])
+    tools = FakeTools(tables={"UDMH.patient_dim": []})
+    policy = ExecutionPolicy(tools, max_round_trips=3)
+    result = asyncio.run(Orchestrator(tools, policy=policy).run(chat, "loop"))
+    assert result.failed
+    assert result.answer == BUDGET_EXHAUSTED
+    assert result.round_trips == 3
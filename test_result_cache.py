@@ -0,0 +1,28 @@
+from result_cache import InMemoryBackend, ResultCache, prompt_key
+
+
+def test_prompt_key_ignores_phrasing():
+    assert prompt_key("How many lab orders are there?") == prompt_key("number of lab orders")
+    assert prompt_key("I want to see the lab orders") == prompt_key("show me all lab orders please")
+
+
+def test_prompt_key_keeps_values():
+    assert prompt_key("how many lab orders") != prompt_key("how many imaging orders")
+    assert prompt_key("stays longer than 2 days") != prompt_key("stays longer than 3 days")
+
+
+def test_answer_hit_and_miss():
+    cache = ResultCache(InMemoryBackend())
+    cache.put_answer("How many lab orders?", "SELECT COUNT(*) FROM UDMH.clncl_ordr_dim", "There are 125.")
+    hit = cache.get_answer("number of lab orders")
+    assert hit["sql"] == "SELECT COUNT(*) FROM UDMH.clncl_ordr_dim"
+    assert hit["answer"] == "There are 125."
+    assert cache.get_answer("number of imaging orders") is None
+    assert cache.stats() == {"prompt_hits": 1, "prompt_misses": 1}
+
+
+def test_query_hit_ignores_whitespace_and_case():
+    cache = ResultCache(InMemoryBackend())
+    cache.put_query("SELECT COUNT(*) FROM t WHERE x = 'A'", "[(1,)]")
+    assert cache.get_query("select count( * )\n from t where x='A';") == "[(1,)]"
+    assert cache.get_query("select count(*) from t where x='a'") is None
@@ -0,0 +1,59 @@
+import pytest
+
+from local_tools import LocalTools
+from rollups import RollupManager, route
+
+ROUTED = [
+    "SELECT order_type, COUNT(*) AS orders FROM UDMH.clncl_ordr_dim GROUP BY order_type",
+    "SELECT department_name, COUNT(1) FROM `proj.UDMH.clncl_ordr_dim` "
+    "WHERE order_date >= DATE '2024-01-01' GROUP BY department_name",
+    "SELECT EXTRACT(MONTH FROM order_date) AS month, COUNT(*) FROM UDMH.clncl_ordr_dim GROUP BY month",
+    "SELECT COUNT(*) FROM UDMH.clncl_ordr_dim WHERE order_type = 'Lab'",
+    "SELECT reason, AVG(DATE_DIFF(discharge_date, admission_date, DAY)) AS los "
+    "FROM UDMH.encounter_dim GROUP BY reason",
+]
+
+NOT_ROUTED = [
+    # COUNT(column) skips NULLs, the rollup counts rows
+    "SELECT order_type, COUNT(order_id) FROM UDMH.clncl_ordr_dim GROUP BY order_type",
+    "SELECT COUNT(*) FROM (SELECT order_type FROM UDMH.clncl_ordr_dim WHERE order_id > 10)",
+    "WITH o AS (SELECT * FROM UDMH.clncl_ordr_dim) SELECT order_type, COUNT(*) FROM o GROUP BY order_type",
+    "SELECT order_type, COUNT(*) FROM UDMH.clncl_ordr_dim GROUP BY order_type "
+    "UNION ALL SELECT order_type, COUNT(*) FROM UDMH.clncl_ordr_dim GROUP BY order_type",
+    "SELECT order_type FROM UDMH.clncl_ordr_dim WHERE order_id IN (SELECT order_id FROM UDMH.clncl_ordr_dim)",
+    "SELECT order_type, COUNT(*) FROM UDMH.clncl_ordr_dim GROUP BY order_type "
+    "EXCEPT DISTINCT SELECT order_type, COUNT(*) FROM UDMH.clncl_ordr_dim WHERE order_type = 'Lab' GROUP BY order_type",
+    "SELECT o.order_type, COUNT(*) FROM UDMH.clncl_ordr_dim o, UDMH.clncl_ordr_dim p GROUP BY o.order_type",
+    "SELECT order_type, COUNT(*) FROM UDMH.clncl_ordr_dim o JOIN UDMH.encounter_dim e USING (patient_id) "
+    "GROUP BY order_type",
+    "SELECT COUNT(DISTINCT order_type) FROM UDMH.clncl_ordr_dim",
+    # order_id is not in the rollup
+    "SELECT order_id, COUNT(*) FROM UDMH.clncl_ordr_dim GROUP BY order_id",
+    # order_date is selected but not grouped by
+    "SELECT order_date, COUNT(*) FROM UDMH.clncl_ordr_dim",
+]
+
+
+@pytest.fixture(scope="module")
+def tools():
+    tools = LocalTools()
+    rollups = RollupManager(tools, tools.dataset_id)
+    rollups.refresh()
+    rollups.refresh()  # the incremental path must give the same tables
+    return tools
+
+
+def _rows(tools, sql):
+    return sorted(tuple(str(value) for value in row) for row in tools.execute(sql))
+
+
+@pytest.mark.parametrize("sql", ROUTED)
+def test_routed_query_gives_the_same_rows(tools, sql):
+    routed = route(sql)
+    assert routed is not None
+    assert _rows(tools, routed) == _rows(tools, sql)
+
+
+@pytest.mark.parametrize("sql", NOT_ROUTED)
+def test_query_a_rollup_cannot_answer_is_not_routed(sql):
+    assert route(sql) is None
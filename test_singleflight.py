@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+
+from singleflight import SingleFlight
+
+
+def _wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_threads_share_one_call():
+    flights = SingleFlight()
+    release = threading.Event()
+    runs = []
+
+    def call():
+        runs.append(1)
+        release.wait(2)
+        return "result"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do("k", call))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    _wait_for(lambda: flights.stats()["coalesced"] == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["result"] * 5
+    assert len(runs) == 1
+    assert flights.stats() == {"executed": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_coroutines_share_one_call():
+    flights = SingleFlight()
+    runs = []
+
+    async def call():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*(flights.do_async("k", call) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["result"] * 5
+    assert len(runs) == 1
+
+
+def test_followers_get_the_exception():
+    flights = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.05)
+        raise ValueError("bad query")
+
+    async def main():
+        return await asyncio.gather(*(flights.do_async("k", call) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert [str(e) for e in errors] == ["bad query"] * 3
+    assert flights.stats()["executed"] == 1
+
+
+def test_forget_lets_the_next_caller_run_again():
+    flights = SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=flights.do, args=("k", release.wait, 2))
+    leader.start()
+    _wait_for(lambda: flights.stats()["in_flight"] == 1)
+    flights.forget("k")
+    assert flights.do("k", lambda: "fresh") == "fresh"
+    release.set()
+    leader.join()
+    assert flights.stats() == {"executed": 2, "coalesced": 0, "in_flight": 0}
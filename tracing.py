@@ -0,0 +1,192 @@
+"""Lightweight spans for each chat turn, exported in OpenTelemetry's JSON shape.
+
+A span covers one stage of a turn (Gemini call, tool dispatch, BigQuery job,
+serialization, render). The current span is kept in a contextvar, so spans
+opened inside asyncio tasks and ``asyncio.to_thread`` workers nest under the
+turn that started them. When a root span ends, its trace is kept in memory
+for the in-app waterfall and handed to the exporter:
+
+- ``TRACE_EXPORT=traces.jsonl`` appends one OTLP/JSON document per trace
+- ``TRACE_EXPORT=http://localhost:4318/v1/traces`` posts it to a collector
+"""
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+import urllib.request
+
+SERVICE_NAME = "clinical-data-chat"
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()
+            ],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class FileExporter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, document):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(document) + "\n")
+
+
+class HttpExporter:
+    """Posts OTLP/JSON to a collector from a background thread."""
+
+    def __init__(self, url, timeout=2.0):
+        self.url = url
+        self.timeout = timeout
+
+    def export(self, document):
+        threading.Thread(target=self._post, args=(document,), daemon=True).start()
+
+    def _post(self, document):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(document).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            urllib.request.urlopen(request, timeout=self.timeout).close()
+        except Exception as e:
+            print("trace export failed: " + str(e))
+
+
+def exporter_from_env(value=None):
+    value = value if value is not None else os.environ.get("TRACE_EXPORT", "")
+    if value.startswith(("http://", "https://")):
+        return HttpExporter(value)
+    if value:
+        return FileExporter(value)
+    return None
+
+
+class Tracer:
+    def __init__(self, exporter=None, keep_traces=100):
+        self.exporter = exporter
+        self._open = {}
+        self._finished = collections.OrderedDict()
+        self.keep_traces = keep_traces
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        parent = _current_span.get()
+        trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        span = Span(name, trace_id, parent.span_id if parent else None, attributes)
+        with self._lock:
+            if parent is None:
+                self._open[trace_id] = [span]
+            elif trace_id in self._open:
+                self._open[trace_id].append(span)
+            # else the root already finished (a tool thread still running after a timeout):
+            # the span is timed for its caller but kept nowhere
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            if parent is None:
+                self._finish(trace_id)
+
+    def _finish(self, trace_id):
+        with self._lock:
+            spans = self._open.pop(trace_id, [])
+            self._finished[trace_id] = spans
+            while len(self._finished) > self.keep_traces:
+                self._finished.popitem(last=False)
+        if self.exporter is not None:
+            self.exporter.export(_otlp_document(spans))
+
+    def trace(self, trace_id):
+        with self._lock:
+            return list(self._finished.get(trace_id, []))
+
+
+def _otlp_document(spans):
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": [s.to_otlp() for s in spans]}],
+        }]
+    }
+
+
+def current_span():
+    return _current_span.get()
+
+
+def waterfall(spans, width=40):
+    """Render a trace as text, one line per span in start order."""
+    if not spans:
+        return ""
+    start = min(s.start_ns for s in spans)
+    end = max(s.end_ns or time.time_ns() for s in spans)
+    total = max(end - start, 1)
+    depth = {}
+    lines = []
+    for s in sorted(spans, key=lambda s: s.start_ns):
+        depth[s.span_id] = depth.get(s.parent_id, -1) + 1
+        offset = int((s.start_ns - start) / total * width)
+        length = max(1, int(((s.end_ns or end) - s.start_ns) / total * width))
+        bar = " " * offset + "█" * min(length, width - offset)
+        label = ("  " * depth[s.span_id] + s.name)[:28]
+        lines.append(f"{label:<28} |{bar:<{width}}| {s.duration_ms:8.1f} ms")
+    return "\n".join(lines)
+
+
+tracer = Tracer(exporter_from_env())
+span = tracer.span
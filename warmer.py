@@ -0,0 +1,237 @@
+"""Precompute the most asked questions so they are cache hits, not cold BigQuery jobs.
+
+``QueryLog`` keeps every answered question with the SQL it ran (in memory,
+and in the JSONL file ``QUERY_LOG`` names so the log survives restarts).
+``CacheWarmer`` takes the top-N questions of the last few days and asks
+them again:
+
+- at the times in ``CACHE_WARM_AT`` (e.g. ``"06:00,12:30"``), so the first
+  questions of the day find fresh answers
+- after a data load: when the newest table modification time in the
+  dataset changes, it refreshes the rollups, drops the cached metadata and
+  results, then warms
+
+Each warmed answer and SQL result is kept for as long as the date window it
+covers is valid (``result_cache.window_ttl``): until midnight for "last 7
+days", a week for a window that has already ended. With a shared
+``RESULT_CACHE_URL`` every instance benefits.
+
+Warming spends Gemini and BigQuery calls, so it only runs when
+``CACHE_WARM_AT`` is set, or on demand after a load:
+
+    QUERY_LOG=queries.jsonl python warmer.py --top 20 --days 7
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+from result_cache import prompt_key, window_ttl
+
+DEFAULT_TOP_N = 20
+DEFAULT_DAYS = 7
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_POLL_SECONDS = 5 * 60
+
+
+class QueryLog:
+    """Answered questions and their SQL, newest last."""
+
+    def __init__(self, path=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self._entries = collections.deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+
+    def record(self, question, sql, mode):
+        entry = {"at": time.time(), "question": question, "sql": sql, "mode": mode}
+        with self._lock:
+            self._entries.append(entry)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+
+    def popular(self, n=DEFAULT_TOP_N, days=DEFAULT_DAYS):
+        """The ``n`` most asked questions of the last ``days``, grouped like the answer cache groups them."""
+        since = time.time() - days * 24 * 60 * 60
+        with self._lock:
+            entries = [e for e in self._entries if e["at"] >= since]
+        groups = {}
+        for entry in entries:
+            key = prompt_key(entry["question"])
+            group = groups.setdefault(key, {"count": 0})
+            # the latest wording and SQL stand for the group
+            group.update(
+                question=entry["question"],
+                sql=entry["sql"] or group.get("sql"),
+                count=group["count"] + 1,
+            )
+        return sorted(groups.values(), key=lambda g: -g["count"])[:n]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def parse_times(text):
+    """``"06:00,12:30"`` -> ``[datetime.time(6, 0), datetime.time(12, 30)]``."""
+    return [datetime.time.fromisoformat(part.strip()) for part in (text or "").split(",") if part.strip()]
+
+
+class CacheWarmer:
+    def __init__(
+        self,
+        engine,
+        log,
+        top_n=DEFAULT_TOP_N,
+        days=DEFAULT_DAYS,
+        warm_at=(),
+        poll_seconds=DEFAULT_POLL_SECONDS,
+        clock=datetime.datetime.now,
+    ):
+        self.engine = engine
+        self.log = log
+        self.top_n = top_n
+        self.days = days
+        self.warm_at = list(warm_at)
+        self.poll_seconds = poll_seconds
+        self._clock = clock
+        self._checked_at = clock()
+        self._data_version = None
+        self._stop = threading.Event()
+        self.runs = 0
+        self.warmed = 0
+        self.failed = 0
+        self.last_run = None
+
+    async def warm_once(self, reason="manual"):
+        """Ask the popular questions again and keep their answers for their date window."""
+        cache = self.engine.result_cache
+        started = time.perf_counter()
+        warmed = failed = 0
+        for entry in self.log.popular(self.top_n, self.days):
+            question = entry["question"]
+            if entry["sql"]:
+                # the tier-1 entry would hand back the stale result
+                await asyncio.to_thread(cache.delete_query, entry["sql"])
+            try:
+                reply = await self.engine.ask(None, question, refresh=True)
+            except Exception as e:
+                print(f"warming {question!r} failed: {e}")
+                failed += 1
+                continue
+            if reply["failed"]:
+                failed += 1
+                continue
+            ttl = window_ttl(reply["sql"] or "", question, default=cache.default_ttl)
+            if reply["mode"] != "template":
+                # templates answer before the answer cache is consulted
+                await asyncio.to_thread(cache.put_answer, question, reply["sql"], reply["answer"], ttl)
+            if reply["sql"]:
+                await asyncio.to_thread(cache.extend_query, reply["sql"], ttl)
+            warmed += 1
+        self.runs += 1
+        self.warmed += warmed
+        self.failed += failed
+        self.last_run = {
+            "reason": reason,
+            "at": self._clock().isoformat(timespec="seconds"),
+            "warmed": warmed,
+            "failed": failed,
+            "seconds": round(time.perf_counter() - started, 1),
+        }
+        print("cache warmer: " + str(self.last_run))
+        return self.last_run
+
+    def _due(self, now):
+        # a scheduled time passed since the last check (also across midnight)
+        previous, self._checked_at = self._checked_at, now
+        day = previous.date()
+        while day <= now.date():
+            for at in self.warm_at:
+                if previous < datetime.datetime.combine(day, at) <= now:
+                    return True
+            day += datetime.timedelta(days=1)
+        return False
+
+    def _data_loaded(self):
+        data_version = getattr(self.engine.tools, "data_version", None)
+        if data_version is None:
+            return False
+        try:
+            version = data_version(self.engine.dataset_id)
+        except Exception as e:
+            print("data version unavailable: " + str(e))
+            return False
+        previous, self._data_version = self._data_version, version
+        return previous is not None and version != previous
+
+    def _after_load(self):
+        rollups = getattr(self.engine, "rollups", None)
+        if rollups is not None:
+            rollups.refresh()
+        if self.engine.metadata_cache is not None:
+            self.engine.metadata_cache.invalidate()
+        self.engine.result_cache.clear()
+
+    def tick(self):
+        """Warm if new data arrived or a scheduled time passed; return the run or None."""
+        if self._data_loaded():
+            self._after_load()
+            return asyncio.run(self.warm_once("data load"))
+        if self._due(self._clock()):
+            return asyncio.run(self.warm_once("schedule"))
+        return None
+
+    def start(self):
+        self._data_loaded()  # the version at startup is the baseline, not a load
+
+        def loop():
+            while not self._stop.wait(self.poll_seconds):
+                try:
+                    self.tick()
+                except Exception as e:
+                    print("cache warmer failed: " + str(e))
+
+        threading.Thread(target=loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            "logged": len(self.log),
+            "runs": self.runs,
+            "warmed": self.warmed,
+            "failed": self.failed,
+            "last_run": self.last_run,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP_N, help="questions to warm")
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS, help="how far back the log is read")
+    args = parser.parse_args(argv)
+    from engine import get_engine
+
+    engine = get_engine()
+    warmer = CacheWarmer(engine, engine.query_log, top_n=args.top, days=args.days)
+    print(json.dumps(asyncio.run(warmer.warm_once("command line"))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())